@@ -0,0 +1,105 @@
+from datetime import date, datetime, timedelta
+import pytz
+import toml
+
+import get_open_meteo
+import metrics
+import startup
+import store
+
+# Dawn, sunrise, sunset, dusk and daylight length for each location, worked
+# out a year at a time and kept in the store, so rendering looks them up by
+# day instead of running astral every time. A location's almanac is
+# regenerated when its position or timezone changes, or when it is about to
+# run out. Events the sun never reaches on a day, e.g. near the poles, are
+# left empty.
+
+DAYS = 366
+MIN_DAYS_LEFT = 7
+
+EVENTS = ['dawn', 'sunrise', 'sunset', 'dusk']
+
+def position(location):
+    return (location['latitude'], location['longitude'], get_open_meteo.timezone_name(location))
+
+def compute(latitude, longitude, timezone, start, days=DAYS):
+    from astral import Observer
+    from astral import sun
+
+    observer = Observer(latitude, longitude)
+    tz = pytz.timezone(timezone)
+
+    rows = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+
+        times = []
+        for event in EVENTS:
+            try:
+                times.append(int(getattr(sun, event)(observer, date=day, tzinfo=tz).timestamp()))
+            except ValueError:
+                times.append(None)
+
+        sunrise, sunset = times[1], times[2]
+        daylight = sunset - sunrise if sunrise is not None and sunset is not None else None
+        rows.append((day.toordinal(), *times, daylight))
+
+    return rows
+
+def ensure(db, location, today):
+    # Starts the day before, so the night leading into today is covered
+    stored = store.almanac_range(db, location['name'])
+    if stored and tuple(stored[:3]) == position(location) and stored[3] is not None \
+            and stored[3] < today.toordinal() and stored[4] >= today.toordinal() + MIN_DAYS_LEFT:
+        return False
+
+    with metrics.span('almanac_generate'):
+        rows = compute(*position(location), today - timedelta(days=1))
+    store.save_almanac(db, location['name'], *position(location), rows)
+    return True
+
+def update(db, config, today=None):
+    if today is None:
+        today = date.today()
+
+    for location in get_open_meteo.locations(config):
+        ensure(db, location, today)
+
+def load(db, location, today, days=3):
+    # The day before today to days after it, by date ordinal
+    ensure(db, location, today)
+    rows = store.load_almanac(db, location['name'], today.toordinal() - 1, today.toordinal() + days)
+    return {row[0]: dict(zip(store.ALMANAC_COLUMNS, row[1:])) for row in rows}
+
+def next_sun(days, now):
+    # The next sunrise and sunset in the loaded days, in now's timezone.
+    # Either is None if it does not happen in them, e.g. in a polar night.
+    def next_event(event):
+        for ordinal in sorted(days):
+            time = days[ordinal].get(event)
+            if ordinal >= now.date().toordinal() and time is not None and time >= now.timestamp():
+                return datetime.fromtimestamp(time, now.tzinfo)
+        return None
+
+    return (next_event('sunrise'), next_event('sunset'))
+
+def nights(days):
+    # (sunset, next sunrise) spans in epoch seconds
+    spans = []
+    for ordinal, day in sorted(days.items()):
+        next_day = days.get(ordinal + 1)
+        if next_day and day['sunset'] is not None and next_day['sunrise'] is not None:
+            spans.append((day['sunset'], next_day['sunrise']))
+    return spans
+
+def main():
+    with open('config.toml') as cin:
+        config = toml.loads(cin.read())
+
+    db = store.connect()
+    update(db, config)
+    db.close()
+
+if __name__ == '__main__':
+    startup.profile_startup()
+    main()
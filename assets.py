@@ -0,0 +1,55 @@
+import glob
+import hashlib
+import os
+
+# Icons rasterised at the size they are drawn at, kept on disk across runs.
+# Cache files are named after the icon, its size and a hash of the SVG, so
+# an edited icon gets a new file and the stale one is removed. Within a run
+# each icon is held in memory, and the SVG is only read and hashed again if
+# its mtime or size changes.
+
+CACHE_DIR = 'asset_cache'
+
+_memory = {}
+
+def cache_file(path, size, digest):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(CACHE_DIR, f'{name}-{size[0]}x{size[1]}-{digest}.png')
+
+def load(path, size):
+    from PIL import Image
+
+    with open(path, 'rb') as f:
+        svg = f.read()
+
+    filename = cache_file(path, size, hashlib.sha1(svg).hexdigest()[:16])
+    if os.path.exists(filename):
+        with Image.open(filename) as image:
+            return image.convert('RGBA')
+
+    from layers import rasterize
+
+    image = rasterize(svg, size).copy()
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    for stale in glob.glob(cache_file(path, size, '*')):
+        os.remove(stale)
+
+    # Named for the process, as timelapse.py renders in several at once
+    tmp_file = f'{filename}.{os.getpid()}.tmp'
+    image.save(tmp_file, format='PNG')
+    os.replace(tmp_file, filename)
+
+    return image
+
+def icon(path, size):
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    key = (path, size)
+    cached = _memory.get(key)
+    if cached is None or cached[0] != version:
+        cached = (version, load(path, size))
+        _memory[key] = cached
+
+    return cached[1]
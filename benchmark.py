@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+# Times each stage of the render path against the recorded station data and
+# forecast in fixtures/, so runs are comparable from one change to the next.
+# Each stage is repeated and its median time reported, along with the peak
+# memory it allocates. Results can be saved and compared with a later run:
+#
+#     python benchmark.py --save before.json
+#     python benchmark.py --compare before.json
+#
+# --compare exits with status 1 if any stage is slower than --threshold.
+#
+# --end-to-end times the daemon's whole cycle instead, fetching from
+# stub_server.py over HTTP, rendering the frame and quantising it, so the
+# fetch-to-frame latency and the number of cycles a minute can be followed
+# in the same way. --latency adds a delay to each stub response.
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import drawsvg as draw
+import numpy as np
+from PIL import Image
+
+import almanac
+import display
+import stations
+import inky_image
+import layers
+import store
+import stub_server
+import gauge
+from colors import TEMP_SCALE, HUMIDITY_SCALE, CO2_SCALE, get_color, interpolate_indexed_colors
+from chart import forecast_chart
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(ROOT, 'fixtures')
+NETATMO_FIXTURE = os.path.join(FIXTURES, 'netatmo_weather.json')
+FORECAST_FIXTURE = os.path.join(FIXTURES, 'weather_display.sqlite')
+
+# The fixtures were recorded at this time, and the benchmark renders as if it
+# were still then
+FIXTURE_TIME = 1792236600
+
+CONFIG = {
+    'location': {'latitude': 50.85, 'longitude': 4.35},
+    'display': {'main_module_icon': 'bed.svg', 'indoor_module_icon': 'sofa.svg'},
+}
+
+# The 7-colour Inky Impression palette at saturation 0, plus its clean colour
+PALETTE = [[0, 0, 0], [255, 255, 255], [0, 255, 0], [0, 0, 255], [255, 0, 0], [255, 255, 0], [255, 140, 0], [255, 255, 255]]
+
+REPEATS = 20
+THRESHOLD = 0.25
+
+def make_forecast_fixture(path=FORECAST_FIXTURE):
+    # From two days before FIXTURE_TIME to a week after, with a daily temperature cycle
+    # and a few showers
+    if os.path.exists(path):
+        os.remove(path)
+
+    now = datetime.fromtimestamp(FIXTURE_TIME, display.local_timezone(CONFIG))
+    midnight = int(now.replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+
+    hours = range(midnight - 2 * 86400, midnight + 8 * 86400, 3600)
+    hourly = dict(date=list(hours), **stub_server.hourly_series(hours, midnight))
+
+    days = range(midnight - 2 * 86400, midnight + 8 * 86400, 86400)
+    daily = dict(date=list(days), **stub_server.daily_series(len(days)))
+
+    db = store.connect(path)
+    store.save_forecast(db, store.DEFAULT_LOCATION, hourly, daily, retention_days=365 * 100)
+    db.execute('PRAGMA journal_mode=DELETE')
+    db.execute('VACUUM')
+    db.close()
+
+def load_fixtures(tmp_dir):
+    with open(NETATMO_FIXTURE) as f:
+        netatmo = stations.build(json.load(f))
+
+    # Work on a copy, as opening the database adds WAL files next to it
+    db_file = os.path.join(tmp_dir, 'weather_display.sqlite')
+    shutil.copy(FORECAST_FIXTURE, db_file)
+    return (netatmo, store.connect(db_file))
+
+def stages(netatmo, db, tmp_dir):
+    now = datetime.fromtimestamp(FIXTURE_TIME, display.local_timezone(CONFIG))
+    hourly, daily = display.load_forecast(db, now)
+    daily_rows = display.rows(daily, 1, 6)
+    sun_days = display.load_almanac(db, CONFIG, now)
+    sunrise, sunset = almanac.next_sun(sun_days, now)
+    nights = almanac.nights(sun_days)
+    panels = display.render(netatmo, hourly, daily, sun_days, CONFIG, now=now)
+    for layer in panels:
+        layer.render()
+    values = [v / 10 for v in range(-200, 400)]
+
+    def get_color_stage():
+        for value in values:
+            get_color(value, TEMP_SCALE, 'hex')
+
+    def interpolate_stage():
+        for scale in (HUMIDITY_SCALE, CO2_SCALE):
+            scale._zones.clear()
+            interpolate_indexed_colors(scale)
+
+    def gauge_stage():
+        gauge.gauge(draw.Drawing(250, 250), 0, 0, 250, [(55, 'black'), (48, 'blue')], '%', HUMIDITY_SCALE)
+
+    def gauge_cold_stage():
+        gauge._arc_geometry.cache_clear()
+        gauge_stage()
+
+    def forecast_stage():
+        forecast_chart(draw.Drawing(800, 480), hourly, daily_rows, sunrise, sunset, nights, now.tzinfo)
+
+    # A frame with flat areas, gradients and noise, for the quantiser
+    gradient = np.linspace(0, 255, display.WIDTH)[np.newaxis, :, np.newaxis] * np.ones((display.HEIGHT, 1, 3))
+    gradient[::2, :, 1] = np.random.default_rng(0).integers(0, 256, (display.HEIGHT // 2, display.WIDTH))
+    gradient[:display.HEIGHT // 3] = 255
+    frame = Image.fromarray(gradient.astype(np.uint8), 'RGB')
+    palette = np.array(PALETTE, dtype=np.uint8)
+
+    def quantise_stage(dither):
+        inky_image._last_quantised = (None, None)
+        inky_image.quantise(frame, palette, dither)
+
+    def render_stage():
+        for layer in display.render(netatmo, hourly, daily, sun_days, CONFIG, now=now):
+            layer.render()
+
+    def as_svg_stage():
+        for layer in panels:
+            layer.drawing.as_svg()
+
+    def composite_stage(cache_dir=None):
+        layers.composite(panels, (display.WIDTH, display.HEIGHT), (display.WIDTH, display.HEIGHT), cache_dir=cache_dir)
+
+    return [
+        ('load_forecast', lambda: display.load_forecast(db, now)),
+        ('get_color', get_color_stage),
+        ('interpolate_indexed_colors', interpolate_stage),
+        ('gauge', gauge_stage),
+        ('gauge (cold)', gauge_cold_stage),
+        ('forecast_chart', forecast_stage),
+        ('load_almanac', lambda: display.load_almanac(db, CONFIG, now)),
+        ('almanac (generate)', lambda: almanac.compute(*almanac.position(CONFIG['location']), now.date())),
+        ('render', render_stage),
+        ('as_svg', as_svg_stage),
+        ('composite', composite_stage),
+        ('composite (cached)', lambda: composite_stage(os.path.join(tmp_dir, 'panel_cache'))),
+        ('quantise', lambda: quantise_stage('none')),
+        ('quantise (ordered)', lambda: quantise_stage('ordered')),
+    ]
+
+def measure(stage, repeats):
+    stage()
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        stage()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    stage()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'median_ms': statistics.median(times) * 1000, 'min_ms': min(times) * 1000, 'peak_kb': peak / 1024}
+
+def run(repeats):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        netatmo, db = load_fixtures(tmp_dir)
+        for name, stage in stages(netatmo, db, tmp_dir):
+            try:
+                results[name] = measure(stage, repeats)
+            except (ImportError, OSError) as e:
+                # cairosvg needs the native cairo library
+                print(f'{name} skipped: {str(e).splitlines()[0]}')
+        db.close()
+
+    return results
+
+def cycle_config(url):
+    return {
+        'location': dict(CONFIG['location'], name=store.DEFAULT_LOCATION),
+        'netatmo': {'client_id': 'stub', 'client_secret': 'stub', 'init_refresh_token': 'stub', 'api_url': url},
+        'open_meteo': {'api_url': url, 'update_model': ''},
+        'display': CONFIG['display'],
+    }
+
+def cycle_stages(fetcher, db, config):
+    # Every fetch brings new observations and a forecast, as the stub stamps
+    # them with the time of the request
+    palette = np.array(PALETTE, dtype=np.uint8)
+    frame = {}
+
+    def fetch_stage():
+        forecast, netatmo = fetcher.fetch(db, None)
+        if forecast is None or netatmo is None:
+            raise RuntimeError('Fetching from the stub server failed')
+        frame['netatmo'] = netatmo
+
+    def render_stage():
+        now = display.local_now(config)
+        hourly, daily = display.load_forecast(db, now)
+        sun_days = display.load_almanac(db, config, now)
+        frame['image'] = display.render_image(frame['netatmo'], hourly, daily, sun_days, config, now=now)
+
+    def cycle_stage():
+        fetch_stage()
+        render_stage()
+        inky_image._last_quantised = (None, None)
+        inky_image.quantise(frame['image'], palette, 'ordered')
+
+    return [
+        ('fetch', fetch_stage),
+        ('render_image', render_stage),
+        ('cycle', cycle_stage),
+    ]
+
+def run_end_to_end(repeats, latency=0):
+    # The token, station and cache files go in the working directory, so the
+    # cycle runs in a scratch directory with copies of the icons
+    import fetch
+
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for icon in glob.glob(os.path.join(ROOT, '*.svg')):
+            shutil.copy(icon, tmp_dir)
+        os.chdir(tmp_dir)
+
+        server = stub_server.start(latency=latency)
+        config = cycle_config(server.url)
+        fetcher = fetch.Fetcher(config)
+        db = store.connect()
+
+        try:
+            for name, stage in cycle_stages(fetcher, db, config):
+                try:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        results[name] = measure(stage, repeats)
+                except (ImportError, OSError) as e:
+                    print(f'{name} skipped: {str(e).splitlines()[0]}')
+        finally:
+            db.close()
+            fetcher.close()
+            server.shutdown()
+            server.server_close()
+            os.chdir(cwd)
+
+    if 'cycle' in results:
+        print(f'{60000 / results["cycle"]["median_ms"]:.1f} cycles a minute')
+
+    return results
+
+def report(results, baseline=None, threshold=THRESHOLD):
+    # Returns the stages that are slower than the baseline by more than threshold
+    slower = []
+
+    print('')
+    header = f'{"stage":<28} {"median ms":>10} {"min ms":>10} {"peak KB":>10}'
+    print(header + (f' {"baseline":>10} {"change":>8}' if baseline else ''))
+
+    for name, result in results.items():
+        line = f'{name:<28} {result["median_ms"]:>10.3f} {result["min_ms"]:>10.3f} {result["peak_kb"]:>10.1f}'
+
+        if baseline and name in baseline:
+            change = result['median_ms'] / baseline[name]['median_ms'] - 1
+            line += f' {baseline[name]["median_ms"]:>10.3f} {change * 100:>+7.1f}%'
+            if change > threshold:
+                slower.append(name)
+                line += '  SLOWER'
+
+        print(line)
+
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=REPEATS, help='Timed runs of each stage')
+    parser.add_argument('--save', metavar='FILE', help='Save the results as JSON')
+    parser.add_argument('--compare', metavar='FILE', help='Compare with results saved by an earlier run')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='Fractional slowdown that fails --compare')
+    parser.add_argument('--make-fixture', action='store_true', help='Regenerate the forecast fixture')
+    parser.add_argument('--end-to-end', action='store_true', help='Time the whole cycle against the stub server')
+    parser.add_argument('--latency', type=float, default=0, help='Milliseconds the stub server waits before each response')
+    args = parser.parse_args()
+
+    if args.make_fixture:
+        make_forecast_fixture()
+        return
+
+    if args.end_to_end:
+        results = run_end_to_end(args.repeats, args.latency / 1000)
+    else:
+        results = run(args.repeats)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['stages']
+
+    slower = report(results, baseline, args.threshold)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'time': int(time.time()), 'python': sys.version.split()[0], 'stages': results}, f, indent=2)
+
+    if slower:
+        print('')
+        print(f'Slower than {args.compare}: {", ".join(slower)}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
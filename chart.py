@@ -0,0 +1,199 @@
+import math
+from datetime import datetime, timedelta
+
+import numpy as np
+import drawsvg as draw
+
+from colors import SUNRISE, SUNSET
+
+# Forecast charts drawn directly as drawsvg primitives. The layout follows the
+# 8x2.75 inch matplotlib figure they replace, scaled to 800x275 pixels.
+
+HOURLY_BOX = (42, 140, 361, 361)
+DAILY_BOX = (448, 140, 766, 361)
+
+FONT_SIZE = 14
+TICK_LENGTH = 5
+TICK_PAD = 5
+AXIS_WIDTH = 1.1
+MARGIN = 0.05
+
+PRECIP_COLOR = '#9999ff'
+NIGHT_COLOR = 'rgb(220, 220, 255)'
+DAY = 86400
+
+def nice_ticks(lo, hi, max_ticks=9):
+    if hi <= lo:
+        hi = lo + 1
+
+    raw_step = (hi - lo) / max_ticks
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    step = next(s * magnitude for s in (1, 2, 2.5, 5, 10) if s * magnitude >= raw_step)
+
+    first = math.ceil(lo / step - 1e-9)
+    last = math.floor(hi / step + 1e-9)
+    ticks = [i * step for i in range(first, last + 1)]
+
+    decimals = max(0, -math.floor(math.log10(step) + 1e-9))
+    if round(step / magnitude, 1) == 2.5:
+        decimals += 1
+
+    return [(t, f'{t:.{decimals}f}') for t in ticks]
+
+def with_margin(lo, hi):
+    # A flat series, e.g. a steady temperature, is centred in a range of 2
+    if hi <= lo:
+        lo, hi = lo - 1, hi + 1
+    margin = (hi - lo) * MARGIN
+    return (lo - margin, hi + margin)
+
+class Axes:
+    def __init__(self, box, xlim, ylim, y2lim):
+        self.left, self.top, self.right, self.bottom = box
+        self.xlim = xlim
+        self.ylim = ylim
+        self.y2lim = y2lim
+
+    def x(self, value):
+        lo, hi = self.xlim
+        return self.left + (np.asarray(value) - lo) / (hi - lo) * (self.right - self.left)
+
+    def _y(self, value, lim):
+        lo, hi = lim
+        return self.bottom - (np.asarray(value) - lo) / (hi - lo) * (self.bottom - self.top)
+
+    def y(self, value):
+        return self._y(value, self.ylim)
+
+    def y2(self, value):
+        return self._y(value, self.y2lim)
+
+    def clip(self, d):
+        clip = draw.ClipPath()
+        clip.append(draw.Rectangle(self.left, self.top, self.right - self.left, self.bottom - self.top))
+        group = draw.Group(clip_path=clip)
+        d.append(group)
+        return group
+
+    def frame(self, d):
+        d.append(draw.Rectangle(self.left, self.top, self.right - self.left, self.bottom - self.top,
+                                fill='none', stroke='black', stroke_width=AXIS_WIDTH))
+
+    def x_ticks(self, d, ticks):
+        for value, label in ticks:
+            x = float(self.x(value))
+            if self.left - 0.5 <= x <= self.right + 0.5:
+                d.append(draw.Line(x, self.bottom, x, self.bottom + TICK_LENGTH, stroke='black', stroke_width=AXIS_WIDTH))
+                d.append(draw.Text(label, FONT_SIZE, x, self.bottom + TICK_LENGTH + TICK_PAD + FONT_SIZE * 0.8,
+                                   fill='black', stroke_width=0, text_anchor='middle'))
+
+    def y_ticks(self, d, ticks, right=False):
+        y_pos = self.y2 if right else self.y
+        x = self.right if right else self.left
+        direction = 1 if right else -1
+
+        for value, label in ticks:
+            y = float(y_pos(value))
+            d.append(draw.Line(x, y, x + direction * TICK_LENGTH, y, stroke='black', stroke_width=AXIS_WIDTH))
+            d.append(draw.Text(label, FONT_SIZE, x + direction * (TICK_LENGTH + TICK_PAD), y,
+                               fill='black', stroke_width=0, text_anchor='start' if right else 'end',
+                               dominant_baseline='central'))
+
+def precip_limits(precip, min_y):
+    # No precipitation axis when it is (nearly) dry
+    if (precip < 0.1).all():
+        return ((0, min_y), False)
+    elif (precip <= min_y).all():
+        return ((0, min_y), True)
+    else:
+        return ((0, float(precip.max()) * (1 + MARGIN)), True)
+
+def temperature_line(d, axes, x, temps, color, linewidth, markers):
+    points = np.column_stack((axes.x(x), axes.y(temps))).ravel().tolist()
+    d.append(draw.Lines(*points, close=False, fill='none', stroke=color, stroke_width=linewidth,
+                        stroke_linejoin='round', stroke_linecap='round'))
+
+    if markers:
+        for px, py in zip(points[0::2], points[1::2]):
+            d.append(draw.Circle(px, py, 4.2, fill=color, stroke_width=0))
+
+def precip_bars(d, axes, x, precip, bar_width):
+    base = float(axes.y2(0))
+    for px, value in zip(x, precip):
+        if value <= 0:
+            continue
+        left = float(axes.x(px - bar_width / 2))
+        width = float(axes.x(px + bar_width / 2)) - left
+        top = float(axes.y2(value))
+        d.append(draw.Rectangle(left, top, width, base - top, fill=PRECIP_COLOR, stroke_width=0))
+
+def hourly_chart(d, hourly, sunrise, sunset, nights, tz):
+    times = np.asarray(hourly['date'], dtype=float)
+    temps = np.asarray(hourly['temperature_2m'], dtype=float)
+    precip = np.asarray(hourly['precipitation'], dtype=float)
+
+    bar_width = 0.025 * DAY
+    xlim = with_margin(times.min() - bar_width / 2, times.max() + bar_width / 2)
+    ylim = with_margin(temps.min(), temps.max())
+    y2lim, precip_ticks = precip_limits(precip, 0.5)
+
+    axes = Axes(HOURLY_BOX, xlim, ylim, y2lim)
+    plot = axes.clip(d)
+
+    # Nights are (start, end) in epoch seconds; the clip trims them to the chart
+    for start, end in nights:
+        left = float(axes.x(start))
+        plot.append(draw.Rectangle(left, axes.top, float(axes.x(end)) - left, axes.bottom - axes.top,
+                                   fill=NIGHT_COLOR, stroke_width=0))
+
+    for time, color in ((sunrise, SUNRISE), (sunset, SUNSET)):
+        if time is None:
+            continue
+        x = float(axes.x(time.timestamp()))
+        plot.append(draw.Line(x, axes.top, x, axes.bottom, stroke=color, stroke_width=2.8))
+
+    precip_bars(plot, axes, times, precip, bar_width)
+    temperature_line(plot, axes, times, temps, 'black', 4.2, False)
+
+    axes.frame(d)
+    axes.y_ticks(d, nice_ticks(*ylim))
+    if precip_ticks:
+        axes.y_ticks(d, nice_ticks(*y2lim), right=True)
+
+    # A tick every three hours, labelled with the local hour
+    start = datetime.fromtimestamp(xlim[0], tz).replace(minute=0, second=0, microsecond=0)
+    hour_ticks = []
+    for hour in range(0, 30):
+        tick = start + timedelta(hours=hour)
+        if tick.hour % 3 == 0:
+            hour_ticks.append((tick.timestamp(), tick.strftime('%H')))
+    axes.x_ticks(d, hour_ticks)
+
+def daily_chart(d, daily, tz):
+    times = np.asarray(daily['date'], dtype=float)
+    mins = np.asarray(daily['temperature_2m_min'], dtype=float)
+    maxs = np.asarray(daily['temperature_2m_max'], dtype=float)
+    precip = np.asarray(daily['precipitation_sum'], dtype=float)
+
+    bar_width = 0.5 * DAY
+    xlim = with_margin(times.min() - bar_width / 2, times.max() + bar_width / 2)
+    ylim = with_margin(min(mins.min(), maxs.min()), max(mins.max(), maxs.max()))
+    y2lim, precip_ticks = precip_limits(precip, 5)
+
+    axes = Axes(DAILY_BOX, xlim, ylim, y2lim)
+    plot = axes.clip(d)
+
+    precip_bars(plot, axes, times, precip, bar_width)
+    temperature_line(plot, axes, times, mins, 'blue', 2.8, True)
+    temperature_line(plot, axes, times, maxs, 'red', 2.8, True)
+
+    axes.frame(d)
+    axes.y_ticks(d, nice_ticks(*ylim))
+    if precip_ticks:
+        axes.y_ticks(d, nice_ticks(*y2lim), right=True)
+
+    axes.x_ticks(d, [(t, datetime.fromtimestamp(t, tz).strftime('%a %-d')) for t in times])
+
+def forecast_chart(d, hourly, daily, sunrise, sunset, nights, tz):
+    hourly_chart(d, hourly, sunrise, sunset, nights, tz)
+    daily_chart(d, daily, tz)
@@ -0,0 +1,148 @@
+import numpy as np
+
+SUNRISE = '#ffc300'
+SUNSET = '#ff8800'
+
+def to_hex(decimal):
+    result = hex(decimal).split('x')[-1]
+    return f'0{result}' if len(result) == 1 else result
+
+def format_color(rgb, type):
+    if type == 'hex':
+        return f'#{to_hex(rgb[0])}{to_hex(rgb[1])}{to_hex(rgb[2])}'
+    elif type == 'rgb':
+        return f'rgb({rgb[0]}, {rgb[1]}, {rgb[2]})'
+    else:
+        return rgb
+
+class ColorScale:
+    # A colour scale compiled once into sorted breakpoint arrays. Lookups use
+    # np.interp, which binary searches the breakpoints and clamps values
+    # outside the scale to the end colours, for a single value or a whole array.
+    def __init__(self, scale):
+        self.scale = scale
+        self.values = np.array([p['value'] for p in scale], dtype=float)
+        self.colors = np.array([p['color'] for p in scale], dtype=float)
+        self._zones = {}
+
+    def __repr__(self):
+        return f'ColorScale({self.scale!r})'
+
+    def __len__(self):
+        return len(self.scale)
+
+    def __getitem__(self, index):
+        return self.scale[index]
+
+    def __iter__(self):
+        return iter(self.scale)
+
+    def _interp(self, values):
+        values = np.asarray(values, dtype=float)
+        result = np.empty(values.shape + (3,))
+        for channel in range(3):
+            result[..., channel] = np.interp(values, self.values, self.colors[:, channel])
+
+        return result
+
+    def rgb(self, values):
+        return np.rint(self._interp(values)).astype(int)
+
+    def color(self, value, type):
+        return format_color(self.rgb(value).tolist(), type)
+
+    def colors_for(self, values, type):
+        return [format_color(rgb, type) for rgb in self.rgb(values).tolist()]
+
+    def zones(self, n=50):
+        if n not in self._zones:
+            target = np.linspace(self.values.min(), self.values.max(), n)
+            rgb = self._interp(target).astype(int)
+
+            self._zones[n] = [
+                (
+                    round(target[i], 2),
+                    round(target[i + 1], 2),
+                    "#{:02X}{:02X}{:02X}".format(*rgb[i])
+                )
+                for i in range(n - 1)
+            ]
+
+        return self._zones[n]
+
+TEMP_SCALE = ColorScale([
+    {"value":  -4.0, "color": [ 29,  70, 154]},
+    {"value":  -2.0, "color": [ 20,  98, 169]},
+    {"value":   0.0, "color": [ 22, 116, 182]},
+    {"value":   2.0, "color": [ 54, 138, 199]},
+    {"value":   4.0, "color": [ 63, 163, 218]},
+    {"value":   6.0, "color": [ 78, 192, 238]},
+    {"value":   8.0, "color": [174, 220, 216]},
+    {"value":  10.0, "color": [168, 214, 173]},
+    {"value":  12.0, "color": [158, 208, 127]},
+    {"value":  14.0, "color": [174, 211,  82]},
+    {"value":  16.0, "color": [208, 217,  62]},
+    {"value":  18.0, "color": [252, 222,   4]},
+    {"value":  20.0, "color": [251, 203,  12]},
+    {"value":  22.0, "color": [252, 183,  22]},
+    {"value":  24.0, "color": [250, 163,  26]},
+    {"value":  26.0, "color": [246, 138,  31]},
+    {"value":  28.0, "color": [242, 106,  47]},
+    {"value":  30.0, "color": [236,  81,  57]},
+    {"value":  32.0, "color": [237,  42,  42]},
+    {"value":  34.0, "color": [195,  32,  39]},
+    {"value":  36.0, "color": [155,  27,  29]}
+])
+
+HUMIDITY_SCALE = ColorScale([
+    {"value":   0, "color": [228,  78,  93]},
+    {"value":  10, "color": [197, 106, 125]},
+    {"value":  20, "color": [160, 138, 166]},
+    {"value":  30, "color": [130, 173, 209]},
+    {"value":  40, "color": [ 97, 183, 218]},
+    {"value":  50, "color": [104, 206, 247]},
+    {"value":  60, "color": [102, 203, 242]},
+    {"value":  70, "color": [ 96, 178, 234]},
+    {"value":  80, "color": [ 89, 154, 233]},
+    {"value":  90, "color": [ 86, 131, 232]},
+    {"value": 100, "color": [ 79, 105, 216]}
+])
+
+PRESSURE_SCALE = ColorScale([
+    {"value":  950.0, "color": [ 34, 150, 255]},
+    {"value":  962.9, "color": [ 11, 199, 253]},
+    {"value":  975.7, "color": [ 57, 251, 251]},
+    {"value":  988.6, "color": [128, 245, 253]},
+    {"value": 1001.4, "color": [253, 241,   8]},
+    {"value": 1014.3, "color": [252, 177,   5]},
+    {"value": 1027.1, "color": [255, 128,   3]},
+    {"value": 1040.0, "color": [254,  66,   0]}
+])
+
+CO2_SCALE = ColorScale([
+    {"value":  400.0, "color": [136, 239, 237]},
+    {"value":  514.3, "color": [ 97, 221, 174]},
+    {"value":  628.6, "color": [124, 200, 108]},
+    {"value":  742.9, "color": [149, 170,  44]},
+    {"value":  857.1, "color": [157, 129,  31]},
+    {"value":  971.4, "color": [153,  93,  50]},
+    {"value": 1085.7, "color": [148,  61,  72]},
+    {"value": 1200.0, "color": [144,  27,  99]}
+])
+
+RAIN_SCALE = ColorScale([
+    {"value":  0.0, "color": [165, 218, 243]},
+    {"value":  4.3, "color": [114, 198, 235]},
+    {"value":  8.6, "color": [ 80, 167, 221]},
+    {"value": 12.9, "color": [ 61, 123, 186]},
+    {"value": 17.1, "color": [ 49,  90, 145]},
+    {"value": 21.4, "color": [ 42,  71, 119]},
+    {"value": 25.7, "color": [ 28,  44,  79]},
+    {"value": 30.0, "color": [ 10,  12,  25]}
+])
+
+def get_color(value, scale, type):
+    return scale.color(value, type)
+
+def interpolate_indexed_colors(scale, n=50):
+    return scale.zones(n)
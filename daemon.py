@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+# Long-running replacement for display.sh. All modules, the config, the HTTP
+# session and the Inky handle are loaded once and reused for every cycle.
+# Netatmo is polled just after the station's next expected upload and the
+# display is only redrawn when there is something new. The forecast is
+# fetched when the model has a new run, and shown straight away. When both
+# are due they are fetched concurrently.
+
+import time
+import traceback
+from datetime import datetime
+
+import toml
+
+import almanac
+import metrics
+import startup
+import store
+import fetch
+import get_open_meteo
+import get_netatmo
+import display
+import inky_image
+
+CYCLE_SECONDS = 900
+
+def render(inky, db, stations, config):
+    now = display.local_now(config)
+    hourly, daily = display.load_forecast(db, now, display.location_name(config))
+    sun_days = display.load_almanac(db, config, now)
+    return display.render_image(stations, hourly, daily, sun_days, config, inky.resolution, now=now)
+
+def push(inky, image, config):
+    settings = config.get('inky', {})
+    # The clock changes on every render, so it alone does not refresh the display
+    inky_image.show_image(inky, image, settings.get('saturation', 0), settings,
+                          ignore=[display.PANELS['timestamp']], layout_size=(display.WIDTH, display.HEIGHT))
+
+def run_stage(name, stage, *args):
+    try:
+        return stage(*args)
+    except Exception:
+        print(f'  {name} failed')
+        traceback.print_exc()
+
+def run_cycle(inky, db, stations, data, force_render, config):
+    # Returns the latest station data, which is the previous data if nothing new arrived
+    if data is not None:
+        stations = data
+    elif not force_render or stations is None:
+        print('  No new observations; skipping render')
+        return stations
+
+    print('  Updating display')
+    image = run_stage('Display', render, inky, db, stations, config)
+
+    if image is not None:
+        print('  Setting display')
+        run_stage('Inky', push, inky, image, config)
+
+    return stations
+
+def main():
+    with open('config.toml') as cin:
+        config = toml.loads(cin.read())
+
+    fetcher = fetch.Fetcher(config)
+    db = store.connect()
+    inky = inky_image.get_inky()
+    run_stage('Almanac', almanac.update, db, config)
+
+    stations = get_netatmo.load_stations()
+    next_forecast = 0
+    next_cycle = 0
+    last_render_hour = None
+
+    while True:
+        metrics.start_cycle()
+        now = time.time()
+        check_forecast = now >= next_forecast
+        poll_netatmo = now >= next_cycle
+
+        print(f'Running at {datetime.now():%Y-%m-%d %H:%M:%S}')
+        if check_forecast:
+            print('  Checking open-meteo forecast')
+        if poll_netatmo:
+            print('  Retrieving Netatmo observations')
+
+        forecast, data = fetcher.fetch(db, stations, netatmo=poll_netatmo, forecast=check_forecast)
+
+        forecast_updated = False
+        if check_forecast:
+            forecast_updated, next_forecast = forecast or (False, now + get_open_meteo.RECHECK_SECONDS)
+            print(f'  Next forecast check: {datetime.fromtimestamp(next_forecast):%Y-%m-%d %H:%M:%S}')
+
+        # A new forecast is shown straight away rather than at the next poll.
+        # The display is also redrawn each hour so the forecast window moves on.
+        if poll_netatmo or forecast_updated:
+            hour = int(now // 3600)
+            force_render = forecast_updated or hour != last_render_hour
+
+            stations = run_cycle(inky, db, stations, data, force_render, config)
+            last_render_hour = hour
+
+        if poll_netatmo:
+            if stations is None:
+                next_cycle = now + CYCLE_SECONDS
+            else:
+                next_cycle = get_netatmo.next_poll(stations, config, time.time())
+            print(f'Next run: {datetime.fromtimestamp(next_cycle):%Y-%m-%d %H:%M:%S}')
+
+        run_stage('Metrics', metrics.finish_cycle, config)
+        print('')
+
+        if startup.profiling():
+            break
+
+        time.sleep(max(0, min(next_forecast, next_cycle) - time.time()))
+
+    fetcher.close()
+
+if __name__ == '__main__':
+    startup.profile_startup()
+    main()
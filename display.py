@@ -1,19 +1,18 @@
-import json
 import toml
-import sqlite3
-import pandas as pd
-import numpy as np
 import drawsvg as draw
 import math
-from datetime import datetime, date, timedelta
-import pytz
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-import matplotlib.dates as mdates
-from matplotlib.ticker import MultipleLocator
-import io
-from astral import LocationInfo
-from astral.sun import sun
+from datetime import datetime
+
+from colors import HUMIDITY_SCALE, PRESSURE_SCALE, CO2_SCALE, SUNRISE, SUNSET, get_color
+from chart import forecast_chart
+from gauge import gauge
+from layers import Layer, composite, PANEL_CACHE_DIR
+import almanac
+import get_open_meteo
+import metrics
+import startup
+import stations
+import store
 
 #MIN_MAX_COLOR = 'rgb(100, 100, 100)'
 MIN_MAX_COLOR = 'black'
@@ -22,201 +21,23 @@ MAX_ARROW_OFF = 'rgb(255, 150, 150)'
 MIN_ARROW_ON = 'rgb(0, 0, 255)'
 MIN_ARROW_OFF = 'rgb(150, 150, 255)'
 
-SUNRISE = '#ffc300'
-SUNSET = '#ff8800'
-
-TEMP_SCALE = [
-    {"value":  -4.0, "color": [ 29,  70, 154]},
-    {"value":  -2.0, "color": [ 20,  98, 169]},
-    {"value":   0.0, "color": [ 22, 116, 182]},
-    {"value":   2.0, "color": [ 54, 138, 199]},
-    {"value":   4.0, "color": [ 63, 163, 218]},
-    {"value":   6.0, "color": [ 78, 192, 238]},
-    {"value":   8.0, "color": [174, 220, 216]},
-    {"value":  10.0, "color": [168, 214, 173]},
-    {"value":  12.0, "color": [158, 208, 127]},
-    {"value":  14.0, "color": [174, 211,  82]},
-    {"value":  16.0, "color": [208, 217,  62]},
-    {"value":  18.0, "color": [252, 222,   4]},
-    {"value":  20.0, "color": [251, 203,  12]},
-    {"value":  22.0, "color": [252, 183,  22]},
-    {"value":  24.0, "color": [250, 163,  26]},
-    {"value":  26.0, "color": [246, 138,  31]},
-    {"value":  28.0, "color": [242, 106,  47]},
-    {"value":  30.0, "color": [236,  81,  57]},
-    {"value":  32.0, "color": [237,  42,  42]},
-    {"value":  34.0, "color": [195,  32,  39]},
-    {"value":  36.0, "color": [155,  27,  29]}
-]
-
-HUMIDITY_SCALE = [
-    {"value":   0, "color": [228,  78,  93]},
-    {"value":  10, "color": [197, 106, 125]},
-    {"value":  20, "color": [160, 138, 166]},
-    {"value":  30, "color": [130, 173, 209]},
-    {"value":  40, "color": [ 97, 183, 218]},
-    {"value":  50, "color": [104, 206, 247]},
-    {"value":  60, "color": [102, 203, 242]},
-    {"value":  70, "color": [ 96, 178, 234]},
-    {"value":  80, "color": [ 89, 154, 233]},
-    {"value":  90, "color": [ 86, 131, 232]},
-    {"value": 100, "color": [ 79, 105, 216]}
-]
-
-PRESSURE_SCALE = [
-    {"value":  950.0, "color": [ 34, 150, 255]},
-    {"value":  962.9, "color": [ 11, 199, 253]},
-    {"value":  975.7, "color": [ 57, 251, 251]},
-    {"value":  988.6, "color": [128, 245, 253]},
-    {"value": 1001.4, "color": [253, 241,   8]},
-    {"value": 1014.3, "color": [252, 177,   5]},
-    {"value": 1027.1, "color": [255, 128,   3]},
-    {"value": 1040.0, "color": [254,  66,   0]}
-]
-
-CO2_SCALE = [
-    {"value":  400.0, "color": [136, 239, 237]},
-    {"value":  514.3, "color": [ 97, 221, 174]},
-    {"value":  628.6, "color": [124, 200, 108]},
-    {"value":  742.9, "color": [149, 170,  44]},
-    {"value":  857.1, "color": [157, 129,  31]},
-    {"value":  971.4, "color": [153,  93,  50]},
-    {"value": 1085.7, "color": [148,  61,  72]},
-    {"value": 1200.0, "color": [144,  27,  99]}
-]
-
-RAIN_SCALE = [
-    {"value":  0.0, "color": [165, 218, 243]},
-    {"value":  4.3, "color": [114, 198, 235]},
-    {"value":  8.6, "color": [ 80, 167, 221]},
-    {"value": 12.9, "color": [ 61, 123, 186]},
-    {"value": 17.1, "color": [ 49,  90, 145]},
-    {"value": 21.4, "color": [ 42,  71, 119]},
-    {"value": 25.7, "color": [ 28,  44,  79]},
-    {"value": 30.0, "color": [ 10,  12,  25]}
-]
-
-
-def _interpolate_color(color1, color2, proportion):
-  return round(color1 + (color2 - color1) * proportion)
-
-def to_hex(decimal):
-    result = hex(decimal).split('x')[-1]
-    return f'0{result}' if len(result) == 1 else result
-
-def get_color(value, scale, type):
-    if value <= scale[0]['value']:
-        result = scale[0]['color']
-    elif value >= scale[-1]['value']:
-        result = scale[-1]['color']
-    else:
-        prev_entry = scale[0]
-        next_entry = scale[1]
-
-        for i in range(0, len(scale)):
-            if scale[i]["value"] == value:
-                prev_entry = scale[i]
-                next_entry = scale[i]
-            elif scale[i]["value"] < value and scale[i + 1]["value"] > value:
-                prev_entry = scale[i]
-                next_entry = scale[i + 1]
-
-        if prev_entry['color'] == next_entry['color']:
-            result = prev_entry['color']
-        else:
-            color_proportion = (value - prev_entry["value"]) / (next_entry["value"] - prev_entry["value"])
-            red_value = _interpolate_color(prev_entry['color'][0], next_entry['color'][0], color_proportion)
-            green_value = _interpolate_color(prev_entry['color'][1], next_entry['color'][1], color_proportion)
-            blue_value = _interpolate_color(prev_entry['color'][2], next_entry['color'][2], color_proportion)
-
-            result = [red_value, green_value, blue_value]
-
-    if type == 'hex':
-        return f'#{to_hex(result[0])}{to_hex(result[1])}{to_hex(result[2])}'
-    elif type == 'rgb':
-        return f'rgb({result[0]}, {result[1]}, {result[2]})'
-    else:
-        return result
-
-def interpolate_indexed_colors(scale, n=50):
-    values = np.array([p["value"] for p in scale])
-    colors = np.array([p["color"] for p in scale])
-
-    target = np.linspace(values.min(), values.max(), n)
-
-    r = np.interp(target, values, colors[:, 0])
-    g = np.interp(target, values, colors[:, 1])
-    b = np.interp(target, values, colors[:, 2])
-
-    def rgb_to_hex(rgb):
-        return "#{:02X}{:02X}{:02X}".format(*rgb)
-
-    return [
-        (
-            round(target[i], 2),
-            round(target[i + 1], 2),
-            rgb_to_hex((int(r[i]), int(g[i]), int(b[i])))
-        )
-        for i in range(n - 1)
-    ]
-
-def gauge_chart(data, unit, scale):
-    zones = interpolate_indexed_colors(scale)
-    min_val = zones[0][0]
-    max_val = zones[-1][1]
-    
-    # Convert value to angular position (0° = max, 180° = min)
-    def val_to_deg(v):
-        return 180.0 * (1.0 - (v - min_val) / (max_val - min_val))
-
-    fig, ax = plt.subplots(figsize=(6, 3))
-    ax.set_aspect('equal')
-
-    # Define geometry
-    outer_r = 1.0
-    thickness = 0.30
-    inner_r = outer_r - thickness
-
-    # Draw each zone as a wedge
-    for a, b, color in zones:
-        theta1 = val_to_deg(b)
-        theta2 = val_to_deg(a)
-        wedge = patches.Wedge(center=(0, 0), r=outer_r,
-                              theta1=theta1, theta2=theta2,
-                              width=thickness,
-                              facecolor=color, edgecolor=color, linewidth=1)
-        ax.add_patch(wedge)
-
-    
-    # Draw the needle
-    for needle in data:
-        # Clamp the input value
-        value = max(min_val, min(max_val, needle[0]))
-        
-        angle_deg = val_to_deg(value)
-        angle_rad = np.deg2rad(angle_deg)
-        needle_len = inner_r * 0.9
-        nx, ny = needle_len * np.cos(angle_rad), needle_len * np.sin(angle_rad)
-        ax.plot([0, nx], [0, ny], lw=3.5, color=needle[1], zorder=5)
-        ax.scatter([0], [0], s=120, color=needle[1], zorder=6)
-
-    label = '/'.join([str(n[0]) for n in data]) + unit
-    
-    # Labels and text
-    ax.text(0, -0.20, label, ha='center', va='center',
-            fontsize=28, fontweight='bold', color='black')
-
-    ax.set_xlim(-1.15, 1.15)
-    ax.set_ylim(-0.35, 1.15)
-    ax.axis('off')
-    plt.tight_layout()
-
-    plot_bytes = io.BytesIO()
-    # Save the figure as an SVG file
-    plt.savefig(plot_bytes, format='svg', transparent=True)
-    plt.close()
-
-    return plot_bytes.getvalue()
+WIDTH = 800
+HEIGHT = 480
+
+# The box (x, y, width, height) each panel is drawn and rasterised in
+PANELS = {
+    'outdoor_temperature': (0, 0, 240, 130),
+    'pressure': (235, 0, 170, 125),
+    'outdoor_humidity': (405, 0, 165, 125),
+    'rain': (570, 14, 230, 126),
+    'timestamp': (600, 0, 200, 14),
+    'forecast': (0, 135, 800, 255),
+    'indoor_temperature': (0, 392, 170, 88),
+    'indoor_humidity': (170, 380, 140, 100),
+    'co2': (310, 380, 140, 100),
+    'sun': (545, 395, 150, 85),
+    'battery': (765, 420, 35, 60),
+}
 
 def split_number(number):
     number_str = str(number)
@@ -338,76 +159,11 @@ def rain(d, module, forecast):
             d.append(draw.Text(f'{hour:.1f}', 18, START, 134, font_weight='Bold', fill=hour_color, stroke_width=0, text_anchor='center'))
         d.append(draw.Text(f'{forecast:.1f}', 18, END, 111, font_weight='Bold', font_style='Italic', fill=forecast_color, stroke_width=0, text_anchor='end'))
 
-#def temperature_plot(ax, dates, temps, points, markers):
-#    x = (dates - dates.min()).dt.total_seconds()  # Convert to seconds
-#    y = temps.values
-#    
-#    xnew = np.linspace(x.min(), x.max(), points)
-#    ynew = np.interp(xnew, x, y)
-#    timestamps_new = dates.min() + pd.to_timedelta(xnew, unit='s')
-#    spline_colors = [get_color(y, TEMP_SCALE, 'hex') for y in ynew]
-#
-#    ax.scatter(timestamps_new, ynew, c=spline_colors, s=1 if markers else 8)
-#
-#    if markers:
-#        ax.scatter(dates, temps, color=[get_color(y, TEMP_SCALE, 'hex') for y in temps])
-
-def temperature_plot(ax, dates, temps, markers, color, linewidth):
-    ax.plot(dates, temps, color=color, linewidth=linewidth, marker='o', markersize=6 if markers else 0)
-
-def precip_plot(ax, dates, precip, bar_width, min_y):
-    ax.bar(dates, precip, color='#9999ff', width=bar_width)
-    if (precip < 0.1).all():
-        ax.set_yticks([])
-    elif (precip <= min_y).all():
-        ax.set_ylim((0, min_y))
-
-def forecast_plot(d, hourly, daily, sunrise, sunset):
-    plt.rc('font', family='Noto Sans Mono', weight='regular', size=10)
-    fig, axs = plt.subplots(1, 2, figsize=(8, 2.75))
-
-    plot_hour = axs[0]
-    temperature_plot(plot_hour, hourly['date'], hourly['temperature_2m'], False, 'black', 3)
-
-    precip_hour = plot_hour.twinx()
-    plot_hour.set_zorder(precip_hour.get_zorder()+1)
-    plot_hour.patch.set_visible(False)
-
-    precip_plot(precip_hour, hourly['date'], hourly['precipitation'], 0.025, 0.5)
-
-    precip_hour.axvline(sunrise, color=SUNRISE, linewidth=2).set_zorder(-100)
-    precip_hour.axvline(sunset, color=SUNSET, linewidth=2).set_zorder(-100)
-
-    plot_hour.xaxis.set_major_formatter(mdates.DateFormatter('%H', tz=cet))
-
-    plot_day = axs[1]
-    temperature_plot(plot_day, daily['date'], daily['temperature_2m_min'], True, 'blue', 2)
-    temperature_plot(plot_day, daily['date'], daily['temperature_2m_max'], True, 'red', 2)
-
-    precip_day = plot_day.twinx()
-    plot_day.set_zorder(precip_day.get_zorder()+1)
-    plot_day.patch.set_visible(False)
-
-    precip_plot(precip_day, daily['date'], daily['precipitation_sum'], 0.5, 5)
-    plot_day.xaxis.set_major_formatter(mdates.DateFormatter('%a %-d', tz=cet))
-    plot_day.xaxis.set_major_locator(MultipleLocator(1))
-
-    plt.tight_layout()
-
-    plot_bytes = io.BytesIO()
-    # Save the figure as an SVG file
-    plt.savefig(plot_bytes, format='svg', transparent=True)
-    plt.close()
-
-    d.append(draw.Image(0, 125, 800, 275, data=plot_bytes.getvalue(), mime_type='image/svg+xml', embed=True))
-
-def indoor_temp(y, icon, module):
+def indoor_temp(d, y, icon, module):
     
     temperature = module['Temperature']
-    humidity = module['Humidity']
-    co2 = module['CO2']
 
-    d.append(draw.Image(10, y - 30, 45, 45, icon, embed=True))
+    d.icon(10, y - 30, 45, icon)
 
     int_part, decimal_part = split_number(temperature)
 
@@ -425,7 +181,7 @@ def indoor_temp(y, icon, module):
  #   co2_color = get_color(co2, CO2_SCALE, 'rgb')
  #   d.append(draw.Text(f'{co2}ppm', 25, 360, y, font_weight='Bold', fill=co2_color, stroke_width=0, text_anchor='end'))
 
-def battery(y, name, value):
+def battery(d, y, name, value):
     d.append(draw.Text(name, 13, 772, y + 4, font_weight="Bold", fill="rgb(50, 50, 50)", stroke_width=0))
    
     if value <= 4000:
@@ -437,132 +193,172 @@ def battery(y, name, value):
 
     d.append(draw.Circle(790, y, 6, stroke_width=0, fill=color))
 
-def get_sun(position, timezone):
-    today = datetime.now().date()
-    tomorrow = today + timedelta(days=1)
+def clock_parts(time):
+    # Hours and minutes, or dashes for a sunrise or sunset that does not happen
+    return (time.strftime("%H"), time.strftime("%M")) if time is not None else ('--', '--')
 
-    location = LocationInfo(name='Home', region='', timezone=timezone,
-                        latitude=position['latitude'], longitude=position['longitude'])
+def sun_info(d, sunrise, sunset):
+    hours, minutes = clock_parts(sunrise)
+    d.icon(550, 402, 45, 'sunrise.svg')
+    d.append(draw.Text(hours, 25, 637, 432, font_weight='Bold', fill=SUNRISE, stroke_width=0, text_anchor='end'))
+    d.append(draw.Text(':', 25, 635, 430, font_weight='Bold', fill=SUNRISE, stroke_width=0))
+    d.append(draw.Text(minutes, 25, 648, 432, font_weight='Bold', fill=SUNRISE, stroke_width=0))
 
-    today_sun = sun(location.observer, date=today, tzinfo=location.timezone)
-    tomorrow_sun = sun(location.observer, date=tomorrow, tzinfo=location.timezone)
+    hours, minutes = clock_parts(sunset)
+    d.icon(550, 442, 45, 'sunset.svg')
+    d.append(draw.Text(hours, 25, 637, 470, font_weight='Bold', fill=SUNSET, stroke_width=0, text_anchor='end'))
+    d.append(draw.Text(':', 25, 635, 468, font_weight='Bold', fill=SUNSET, stroke_width=0))
+    d.append(draw.Text(minutes, 25, 648, 470, font_weight='Bold', fill=SUNSET, stroke_width=0))
 
-    sunrise = today_sun['sunrise'] if today_sun['sunrise'] >= datetime.now(timezone) else tomorrow_sun['sunrise'] 
-    sunset = today_sun['sunset'] if today_sun['sunset'] >= datetime.now(timezone) else tomorrow_sun['sunset'] 
 
-    return(sunrise, sunset)
+def load_netatmo():
+    return stations.load()
 
-def sun_info(d, sunrise, sunset):
-    d.append(draw.Image(550, 402, 45, 45, 'sunrise.svg', embed=True))
-    d.append(draw.Text(sunrise.strftime("%H"), 25, 637, 432, font_weight='Bold', fill=SUNRISE, stroke_width=0, text_anchor='end'))
-    d.append(draw.Text(':', 25, 635, 430, font_weight='Bold', fill=SUNRISE, stroke_width=0))
-    d.append(draw.Text(sunrise.strftime("%M"), 25, 648, 432, font_weight='Bold', fill=SUNRISE, stroke_width=0))
+def location_name(config):
+    return config['location'].get('name', store.DEFAULT_LOCATION)
 
-    d.append(draw.Image(550, 442, 45, 45, 'sunset.svg', embed=True))
-    d.append(draw.Text(sunset.strftime("%H"), 25, 637, 470, font_weight='Bold', fill=SUNSET, stroke_width=0, text_anchor='end'))
-    d.append(draw.Text(':', 25, 635, 468, font_weight='Bold', fill=SUNSET, stroke_width=0))
-    d.append(draw.Text(sunset.strftime("%M"), 25, 648, 470, font_weight='Bold', fill=SUNSET, stroke_width=0))
+def local_timezone(config):
+    return get_open_meteo.timezone(config['location'])
 
+def local_now(config):
+    return datetime.now(local_timezone(config))
 
-# Load Data
-with open('netatmo_weather.json') as nin:
-    netatmo = json.load(nin)
+def load_forecast(db, now, location=store.DEFAULT_LOCATION):
+    # The next 24 hours, and today plus the following five days, as arrays
+    # by column. Dates are epoch seconds.
+    current_hour = now.replace(minute=0, second=0, microsecond=0)
+    start = int(current_hour.timestamp())
 
-with open('config.toml') as cin:
-    config = toml.loads(cin.read())
+    with metrics.span('sqlite_read'):
+        hourly = store.read_columns(db, store.hourly_query(location, start, start + 24 * 3600), store.HOURLY_COLUMNS)
+        daily = store.read_columns(db, store.daily_query(location, start, 6), store.DAILY_COLUMNS)
 
-main_module = netatmo['devices'][0]['dashboard_data']
-outdoor_module = None
-indoor_module = None
-rain_module = None
+    return (hourly, daily)
 
-for module in netatmo['devices'][0]['modules']:
-    module_name = module['module_name']
+def load_almanac(db, config, now=None):
+    if now is None:
+        now = local_now(config)
 
-    if module_name == 'Outdoor Module':
-        outdoor_module = module['dashboard_data']
-        outdoor_module['battery'] = module['battery_vp']
-    elif module_name == 'Indoor 1':
-        indoor_module = module['dashboard_data']
-        indoor_module['battery'] = module['battery_vp']
-    elif module_name == 'Rain':
-        rain_module = module['dashboard_data']
-        rain_module['battery'] = module['battery_vp']
+    location = dict(config['location'], name=location_name(config))
+    with metrics.span('almanac'):
+        return almanac.load(db, location, now.date())
 
-with sqlite3.connect('weather_display.sqlite') as db:
-    hourly = pd.read_sql('SELECT * FROM open_meteo_hourly', db, parse_dates=['date'])
-    daily = pd.read_sql('SELECT * FROM open_meteo_daily', db, parse_dates='date')
+def rows(columns, start, end):
+    return {column: values[start:end] for column, values in columns.items()}
 
-cet = pytz.timezone('Europe/Brussels')
-current_hour = datetime.now(cet).replace(minute=0, second=0, microsecond=0)
-plus_24_hours = current_hour + pd.Timedelta(hours=24)
-hourly = hourly[(hourly['date'] >= current_hour) & (hourly['date'] <= plus_24_hours)].copy()
+def fields(module, *names):
+    # Only the readings a panel shows, so it is only drawn again when they change
+    return {name: module[name] for name in names}
 
-today_forecast = daily.iloc[0]
-daily = daily[1:6].copy()
+def pressure_panel(d, module):
+    gauge(d, 197, -85, 250, [(module['Pressure'], '#2F4F4F')], 'mb', PRESSURE_SCALE)
+    pressure_trend(d, module)
 
-# Canvas
-d = draw.Drawing(800, 480, origin=(0, 0), font_family='Noto Sans Mono')
-r = draw.Rectangle(0, 0, 800, 480, fill="white", stroke=None)
-d.append(r)
+def indoor_temps(d, indoor_icon, indoor_module, main_icon, main_module):
+    indoor_temp(d, 433, indoor_icon, indoor_module)
+    indoor_temp(d, 468, main_icon, main_module)
 
-sunrise, sunset = get_sun(config['location'], cet)
+def batteries(d, outdoor, rain, indoor):
+    battery(d, 436, 'O', outdoor)
+    battery(d, 453, 'R', rain)
+    battery(d, 470, 'L', indoor)
 
-outdoor_temperature(d, outdoor_module)
-1
-pressure = main_module['Pressure']
-pressure_text = f'{pressure:.01f}'
+def timestamp(d, time):
+    d.append(draw.Text(time.strftime("%Y-%m-%d %H:%M:%S"), 10, 800, 10, font_weight='Regular', fill='black', stroke_width=0, text_anchor='end'))
 
-pressure_chart = gauge_chart([(pressure, '#2F4F4F')], 'mb', PRESSURE_SCALE)
-d.append(draw.Image(197, -85, 250, 250, data=pressure_chart, mime_type='image/svg+xml', embed=True))
+def render(netatmo, hourly, daily, sun_days, config, now=None):
+    if now is None:
+        now = local_now(config)
 
-pressure_trend(d, main_module)
+    modules = stations.select(netatmo, config['display'])
+    main_module = stations.dashboard(modules['main'])
+    outdoor_module = stations.dashboard(modules['outdoor'])
+    indoor_module = stations.dashboard(modules['indoor'])
+    rain_module = stations.dashboard(modules['rain'])
 
-humidity = outdoor_module['Humidity']
-humidity_text = f'{humidity}%'
+    today_precipitation = round(float(daily['precipitation_sum'][0]), 1)
+    daily = rows(daily, 1, 6)
 
-humidity_chart = gauge_chart([(humidity, '#2F4F4F')], '%', HUMIDITY_SCALE)
-d.append(draw.Image(360, -85, 250, 250, data=humidity_chart, mime_type='image/svg+xml', embed=True))
+    # Each panel is drawn in 800x480 layout units into its own layer, and the
+    # layers are scaled to the output size when they are composited. A panel
+    # is drawn from the inputs given here, and only if they have changed
+    # since it was last drawn.
+    layers = []
+
+    def panel(name, function, *inputs, cache=True):
+        layers.append(Layer(name, *PANELS[name], function, inputs, cache))
+
+    sunrise, sunset = almanac.next_sun(sun_days, now)
+
+    panel('outdoor_temperature', outdoor_temperature,
+          fields(outdoor_module, 'Temperature', 'temp_trend', 'max_temp', 'min_temp'))
+
+    panel('pressure', pressure_panel, fields(main_module, 'Pressure', 'pressure_trend'))
+
+    panel('outdoor_humidity', gauge, 360, -85, 250, [(outdoor_module['Humidity'], '#2F4F4F')], '%', HUMIDITY_SCALE)
+
+    #pressure(d, main_module)
+    #humidity(d, outdoor_module)
+    panel('rain', rain, fields(rain_module, 'sum_rain_1', 'sum_rain_24'), today_precipitation)
+
+    panel('forecast', forecast_chart, hourly, daily, sunrise, sunset, almanac.nights(sun_days), local_timezone(config))
+
+    panel('indoor_temperature', indoor_temps,
+          config['display']['indoor_module_icon'], fields(indoor_module, 'Temperature'),
+          config['display']['main_module_icon'], fields(main_module, 'Temperature'))
+
+    INDOOR_COLOR = '#F18219'
+    MAIN_COLOR = '#0B70B8'
+
+    humidity_data = [
+        (indoor_module['Humidity'], INDOOR_COLOR),
+        (main_module['Humidity'], MAIN_COLOR)
+    ]
+
+    panel('indoor_humidity', gauge, 140, 320, 200, humidity_data, '%', HUMIDITY_SCALE)
+
+    co2_data = [
+        (indoor_module['CO2'], INDOOR_COLOR),
+        (main_module['CO2'], MAIN_COLOR)
+    ]
 
-#pressure(d, main_module)
-#humidity(d, outdoor_module)
-rain(d, rain_module, today_forecast['precipitation_sum'])
-forecast_plot(d, hourly, daily, sunrise, sunset)
+    panel('co2', gauge, 285, 320, 200, co2_data, 'ppm', CO2_SCALE)
 
-indoor_temp(433, config['display']['indoor_module_icon'], indoor_module)
-indoor_temp(468, config['display']['main_module_icon'], main_module)
+    panel('sun', sun_info, sunrise, sunset)
 
-indoor_humidity = indoor_module['Humidity']
-main_humidity = main_module['Humidity']
+    panel('battery', batteries, outdoor_module['battery'], rain_module['battery'], indoor_module['battery'])
 
-INDOOR_COLOR = '#F18219'
-MAIN_COLOR = '#0B70B8'
+    panel('timestamp', timestamp, now, cache=False)
 
-humidity_data = [
-    (indoor_humidity, INDOOR_COLOR),
-    (main_humidity, MAIN_COLOR)
-]
+    return layers
 
-indoor_humidity_chart = gauge_chart(humidity_data, '%', HUMIDITY_SCALE)
-d.append(draw.Image(140, 320, 200, 200, data=indoor_humidity_chart, mime_type='image/svg+xml', embed=True))
+def render_image(netatmo, hourly, daily, sun_days, config, size=(WIDTH, HEIGHT), now=None, cache_dir=PANEL_CACHE_DIR):
+    # The display as at now, by default the current time
+    with metrics.span('render'):
+        layers = render(netatmo, hourly, daily, sun_days, config, now)
 
-indoor_co2 = indoor_module['CO2']
-main_co2 = main_module['CO2']
+    with metrics.span('rasterize'):
+        image = composite(layers, (WIDTH, HEIGHT), size, cache_dir=cache_dir)
 
-co2_data = [
-    (indoor_co2, INDOOR_COLOR),
-    (main_co2, MAIN_COLOR)
-]
+    debug_png = config['display'].get('debug_png')
+    if debug_png:
+        image.save(debug_png)
 
-co2_chart = gauge_chart(co2_data, 'ppm', CO2_SCALE)
-d.append(draw.Image(285, 320, 200, 200, data=co2_chart, mime_type='image/svg+xml', embed=True))
+    return image
 
-sun_info(d, sunrise, sunset)
+def main():
+    with open('config.toml') as cin:
+        config = toml.loads(cin.read())
 
-battery(436, 'O', outdoor_module['battery'])
-battery(453, 'R', rain_module['battery'])
-battery(470, 'L', indoor_module['battery'])
+    now = local_now(config)
+    db = store.connect()
+    hourly, daily = load_forecast(db, now, location_name(config))
+    sun_days = load_almanac(db, config, now)
+    db.close()
 
-d.append(draw.Text(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 10, 800, 10, font_weight='Regular', fill='black', stroke_width=0, text_anchor='end'))
+    image = render_image(load_netatmo(), hourly, daily, sun_days, config, now=now)
+    image.save("display.png")
 
-d.save_png("display.png")
+if __name__ == '__main__':
+    startup.profile_startup()
+    main()
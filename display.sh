@@ -19,7 +19,7 @@ while true; do
     python display.py
 
     echo "  Setting display"
-    python inky_image.py --file display.png --saturation 0
+    python inky_image.py --file display.png --saturation 0 --ignore-clock
 
     next_run=$(date -d "+15 minutes" +"%Y-%m-%d %H:%M:%S")
     echo "Next run: $next_run"
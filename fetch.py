@@ -0,0 +1,132 @@
+import asyncio
+import time
+import traceback
+
+import metrics
+import stations
+import steps
+import tokens
+import get_netatmo
+import get_open_meteo
+
+# Fetch layer for the daemon. The Netatmo and open-meteo requests run
+# concurrently on one async session, so a cycle takes as long as the slower
+# of the two rather than their sum. The event loop and the session live as
+# long as the daemon, so connections are kept alive from one cycle to the
+# next. Every request has its own timeout, and each source, and the Netatmo
+# history sync after it, has an overall budget that covers its retries and
+# paging.
+
+TIMEOUT = 10
+BUDGET = 60
+RETRIES = 3
+
+class Fetcher:
+    def __init__(self, config):
+        import niquests
+        import openmeteo_requests
+
+        settings = config.get('fetch', {})
+        self.config = config
+        self.timeout = settings.get('timeout', TIMEOUT)
+        self.budget = settings.get('budget', BUDGET)
+
+        self.loop = asyncio.new_event_loop()
+        self.session = niquests.AsyncSession(retries=RETRIES)
+        self.openmeteo = openmeteo_requests.AsyncClient(self.session)
+
+        self.tokens = tokens.TokenManager(config)
+        self.tokens.start()
+
+    def close(self):
+        self.tokens.stop()
+        self.loop.run_until_complete(self.session.close())
+        self.loop.close()
+
+    def fetch(self, db, previous, netatmo=True, forecast=True):
+        # Returns (forecast, stations). forecast is (updated, next check) as
+        # from get_open_meteo.update_forecast, and stations is the new Netatmo
+        # data if there is any. Either is None if it was not requested or failed.
+        start = time.time()
+        results = self.loop.run_until_complete(self._fetch(db, previous, netatmo, forecast))
+        print(f'  Fetched in {time.time() - start:.1f}s')
+        return results
+
+    async def _fetch(self, db, previous, netatmo, forecast):
+        return tuple(await asyncio.gather(
+            self._run('open-meteo', 'open_meteo_fetch', self._forecast(db)) if forecast else self._skip(),
+            self._netatmo(db, previous) if netatmo else self._skip(),
+        ))
+
+    async def _skip(self):
+        return None
+
+    async def _run(self, name, stage, coroutine):
+        try:
+            with metrics.span(stage):
+                return await asyncio.wait_for(coroutine, self.budget)
+        except Exception:
+            print(f'  {name} failed')
+            traceback.print_exc()
+
+    async def _get(self, url, **kwargs):
+        return await self.session.get(url, timeout=self.timeout, **kwargs)
+
+    async def _forecast(self, db):
+        return await steps.run_async(get_open_meteo.forecast_update(db, self.config), self._open_meteo)
+
+    async def _open_meteo(self, request):
+        kind, url, params = request
+        if kind == get_open_meteo.FORECAST:
+            return await self.openmeteo.weather_api(url, params=params, timeout=self.timeout)
+
+        response = await self._get(url)
+        response.raise_for_status()
+        return response.json()
+
+    async def _netatmo(self, db, previous):
+        # The history sync has its own budget, and new observations are
+        # returned for rendering even if it fails
+        model = await self._run('Netatmo', 'netatmo_fetch', self._stations(db, previous))
+        if model is not None:
+            await self._run('Netatmo history', 'netatmo_history', self._sync_measures(db, model))
+        return model
+
+    async def _stations(self, db, previous):
+        # The token is renewed in the background, so this does not wait on a refresh
+        headers = self.tokens.headers()
+
+        response = await self._get(tokens.api_url(self.config, get_netatmo.STATIONS_PATH), headers=headers)
+        if response.status_code != 200:
+            print(f"Error: {response.status_code} - {response.text}")
+            return None
+
+        model = stations.build(response.json()['body'])
+        if not get_netatmo.has_new_data(previous, model):
+            return None
+
+        get_netatmo.save_stations(model)
+        return model
+
+    async def _sync_measures(self, db, model):
+        # A module that fails does not stop the others; each failure is logged
+        headers = self.tokens.headers()
+        modules = list(get_netatmo.measure_requests(db, model, self.config))
+        results = await asyncio.gather(*[self._module_measures(db, headers, *module) for module in modules],
+                                       return_exceptions=True)
+
+        for (_, module_id, _, _), result in zip(modules, results):
+            if isinstance(result, Exception):
+                print(f'  Netatmo history for {module_id} failed')
+                traceback.print_exception(result)
+
+    async def _module_measures(self, db, headers, *request):
+        # Pages of one module follow each other; modules are fetched concurrently
+        url = tokens.api_url(self.config, get_netatmo.MEASURE_PATH)
+
+        async def send(params):
+            response = await self._get(url, headers=headers, params=params)
+            response.raise_for_status()
+            return response.json()['body']
+
+        await steps.run_async(get_netatmo.measure_pages(db, *request), send)
@@ -0,0 +1,72 @@
+import math
+from functools import lru_cache
+
+import drawsvg as draw
+
+from colors import interpolate_indexed_colors
+
+# Geometry is in gauge units: the arc has an outer radius of 1 and is centred
+# on (0, 0) with y pointing down, as in SVG. The box mapping below reproduces
+# the layout of the old 6x3 inch matplotlib figure embedded in a square image.
+OUTER_R = 1.0
+THICKNESS = 0.30
+INNER_R = OUTER_R - THICKNESS
+
+UNIT = 0.3
+CENTRE_Y = 0.62
+LABEL_Y = 0.20
+FONT_SIZE = 0.0648
+NEEDLE_WIDTH = 0.0081
+HUB_RADIUS = 0.0127
+EDGE_WIDTH = 0.0023
+
+def _point(radius, degrees):
+    angle = math.radians(degrees)
+    return (radius * math.cos(angle), -radius * math.sin(angle))
+
+@lru_cache(maxsize=None)
+def _arc_geometry(scale):
+    zones = interpolate_indexed_colors(scale)
+    min_val = zones[0][0]
+    max_val = zones[-1][1]
+
+    # Convert value to angular position (0° = max, 180° = min)
+    def val_to_deg(v):
+        return 180.0 * (1.0 - (v - min_val) / (max_val - min_val))
+
+    arc = draw.Group()
+    for a, b, color in zones:
+        ox1, oy1 = _point(OUTER_R, val_to_deg(b))
+        ox2, oy2 = _point(OUTER_R, val_to_deg(a))
+        ix2, iy2 = _point(INNER_R, val_to_deg(a))
+        ix1, iy1 = _point(INNER_R, val_to_deg(b))
+
+        path = (f'M{ox1:.4f},{oy1:.4f} A{OUTER_R},{OUTER_R} 0 0 0 {ox2:.4f},{oy2:.4f} '
+                f'L{ix2:.4f},{iy2:.4f} A{INNER_R},{INNER_R} 0 0 1 {ix1:.4f},{iy1:.4f} Z')
+        arc.append(draw.Path(d=path, fill=color, stroke=color, stroke_width=EDGE_WIDTH / UNIT))
+
+    return (min_val, max_val, arc)
+
+def gauge(d, x, y, size, data, unit, scale):
+    min_val, max_val, arc = _arc_geometry(scale)
+
+    s = size * UNIT
+    cx = x + size / 2
+    cy = y + size * CENTRE_Y
+
+    zones = draw.Group(transform=f'translate({cx},{cy}) scale({s})')
+    zones.append(arc)
+    d.append(zones)
+
+    # Draw the needles
+    for needle in data:
+        # Clamp the input value
+        value = max(min_val, min(max_val, needle[0]))
+
+        nx, ny = _point(INNER_R * 0.9 * s, 180.0 * (1.0 - (value - min_val) / (max_val - min_val)))
+        d.append(draw.Line(cx, cy, cx + nx, cy + ny, stroke=needle[1], stroke_width=size * NEEDLE_WIDTH, stroke_linecap='round'))
+        d.append(draw.Circle(cx, cy, size * HUB_RADIUS, fill=needle[1], stroke_width=0))
+
+    label = '/'.join([str(n[0]) for n in data]) + unit
+    d.append(draw.Text(label, size * FONT_SIZE, cx, cy + LABEL_Y * s, font_weight='Bold', fill='black',
+                       stroke_width=0, text_anchor='middle', dominant_baseline='central'))
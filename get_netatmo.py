@@ -1,69 +1,152 @@
+import argparse
 import toml
-import os
-from requests_oauthlib import OAuth2Session
 import time
-import json
-import requests
-
-with open('config.toml') as c:
-    config = toml.load(c)
-
-TOKEN_FILE = "netatmo_token.json"
-
-def token_updater(token):
-    # Save the new token to a file or any storage solution
-    print("Updating token:", token)
-    with open(TOKEN_FILE, 'w') as f:
-        json.dump(token, f)
-
-def save_token_data(token_data):
-    with open(TOKEN_FILE, 'w') as f:
-        json.dump(token_data, f)
-
-def load_token_data():
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE, 'r') as f:
-            return json.load(f)
-    return None
-
-def get_oauth_session():
-    token_data = load_token_data()
-
-    if token_data and time.time() < token_data['expires_at'] - 60:
-        oauth = OAuth2Session(config['netatmo']['client_id'], token=token_data)
-        return oauth
-
-    oauth = OAuth2Session(config['netatmo']['client_id'], redirect_uri='http://localhost', token_updater=token_updater)
-    token = oauth.refresh_token(
-        'https://api.netatmo.com/oauth2/token',
-        client_id=config['netatmo']['client_id'],
-        client_secret=config['netatmo']['client_secret'],
-        refresh_token=config['netatmo']['init_refresh_token']
-    )
-
-    token_data = {
-        'access_token': token['access_token'],
-        'refresh_token': token['refresh_token'],
-        'expires_at': time.time() + token['expires_in']
+
+import startup
+import stations
+import steps
+import store
+import tokens
+
+STATIONS_PATH = '/api/getstationsdata'
+MEASURE_PATH = '/api/getmeasure'
+
+# The measurements getmeasure can return for each module type
+MEASURE_TYPES = {
+    'NAMain': ['temperature', 'humidity', 'co2', 'pressure', 'noise'],
+    'NAModule1': ['temperature', 'humidity'],
+    'NAModule2': ['windstrength', 'windangle', 'guststrength', 'gustangle'],
+    'NAModule3': ['rain'],
+    'NAModule4': ['temperature', 'humidity', 'co2'],
+}
+
+MEASURE_LIMIT = 1024
+HISTORY_DAYS = 7
+
+# Stations upload to Netatmo every ten minutes. Polling just after the next
+# expected upload gets new data on screen quickly without polling twice for
+# the same measurement.
+UPLOAD_INTERVAL = 600
+POLL_DELAY = 30
+MIN_POLL_INTERVAL = 120
+
+def get_headers(config):
+    return tokens.TokenManager(config).headers()
+
+def fetch_stations(session, config):
+    headers = get_headers(config)
+
+    response = session.get(tokens.api_url(config, STATIONS_PATH), headers=headers)
+
+    if response.status_code == 200:
+        return response.json()['body']
+    else:
+        print(f"Error: {response.status_code} - {response.text}")
+        return None
+
+def save_stations(model):
+    stations.save(model)
+
+def load_stations():
+    return stations.load()
+
+def has_new_data(previous, model):
+    return previous is None or stations.measurement_times(previous) != stations.measurement_times(model)
+
+def next_poll(model, config, now):
+    interval = config['netatmo'].get('upload_interval', UPLOAD_INTERVAL)
+    delay = config['netatmo'].get('poll_delay', POLL_DELAY)
+
+    last_upload = max(station['last_upload'] for station in model['stations'].values())
+
+    # If the upload is overdue, check back shortly rather than straight away
+    return max(last_upload + interval + delay, now + MIN_POLL_INTERVAL)
+
+def measure_params(device_id, module_id, types, date_begin):
+    params = {
+        'device_id': device_id,
+        'scale': 'max',
+        'type': ','.join(types),
+        'date_begin': date_begin,
+        'limit': MEASURE_LIMIT,
+        'optimize': 'false',
+        'real_time': 'true'
     }
-    save_token_data(token_data)
 
-    oauth.token = token_data
-    return oauth
+    if module_id != device_id:
+        params['module_id'] = module_id
 
-oauth = get_oauth_session()
+    return params
 
+def parse_measures(body):
+    # With optimize=false the body maps each timestamp to a list of values
+    # in the order of the requested types. With no measurements it is an
+    # empty list instead.
+    return sorted((int(timestamp), values) for timestamp, values in (body.items() if body else []))
 
-headers = {
-    'Authorization': f'Bearer {oauth.access_token}'
-}
+def fetch_measures(session, url, headers, params):
+    response = session.get(url, params=params, headers=headers)
+    response.raise_for_status()
+    return response.json()['body']
+
+def measure_pages(db, device_id, module_id, types, date_begin):
+    # Yields the getmeasure parameters for each page of one module's history
+    # and is sent the response body. Rows are stored as each page arrives.
+    while True:
+        rows = parse_measures((yield measure_params(device_id, module_id, types, date_begin)))
+        store.save_measures(db, module_id, types, rows)
+
+        if len(rows) < MEASURE_LIMIT:
+            return
+
+        date_begin = rows[-1][0] + 1
+
+def measure_requests(db, model, config, backfill_days=None):
+    # Yields (device_id, module_id, types, date_begin) for each module with
+    # measurements. Modules with nothing stored yet start history_days back.
+    # A backfill refetches everything from backfill_days back; rows that are
+    # already stored are replaced.
+    history_days = config['netatmo'].get('history_days', HISTORY_DAYS)
+    start = int(time.time()) - (backfill_days or history_days) * 86400
+
+    for module_id, module in model['modules'].items():
+        types = MEASURE_TYPES.get(module['type'])
+        if types is None:
+            continue
+
+        last = None if backfill_days else store.last_measure_time(db, module_id)
+        yield (module['station'], module_id, types, last + 1 if last else start)
+
+def sync_measures(session, db, model, config, backfill_days=None):
+    # Fetch each module's time series from the last stored measurement
+    # onwards, a page at a time
+    headers = get_headers(config)
+    url = tokens.api_url(config, MEASURE_PATH)
+
+    for request in measure_requests(db, model, config, backfill_days):
+        steps.run(measure_pages(db, *request), lambda params: fetch_measures(session, url, headers, params))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backfill", type=int, metavar="DAYS", help="Fetch this many days of measurement history")
+    args, _ = parser.parse_known_args()
+
+    with open('config.toml') as c:
+        config = toml.load(c)
+
+    import requests
+
+    session = requests.Session()
+
+    data = fetch_stations(session, config)
+    if data is not None:
+        model = stations.build(data)
+        save_stations(model)
 
-response = requests.get('https://api.netatmo.com/api/getstationsdata', headers=headers)
+        db = store.connect()
+        sync_measures(session, db, model, config, args.backfill)
+        db.close()
 
-if response.status_code == 200:
-    data = response.json()
-    
-    with open("netatmo_weather.json", "w") as out:
-        json.dump(data['body'], out)
-else:
-    print(f"Error: {response.status_code} - {response.text}")
+if __name__ == '__main__':
+    startup.profile_startup()
+    main()
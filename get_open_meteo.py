@@ -1,78 +1,157 @@
-import openmeteo_requests
-import requests_cache
-from retry_requests import retry
-import pandas as pd
 from datetime import datetime
+import time
 import pytz
-import sqlite3
 import toml
 
-with open('config.toml') as cin:
-    config = toml.loads(cin.read())
-
-
-# Setup the Open-Meteo API client with cache and retry on error
-cache_session = requests_cache.CachedSession('.cache', expire_after = 3600)
-retry_session = retry(cache_session, retries = 5, backoff_factor = 0.2)
-openmeteo = openmeteo_requests.Client(session = retry_session)
-
-# Make sure all required weather variables are listed here
-# The order of variables in hourly or daily is important to assign them correctly below
-url = "https://api.open-meteo.com/v1/forecast"
-params = {
-    "latitude": config['location']['latitude'],
-    "longitude": config['location']['longitude'],
-    "daily": ["temperature_2m_max", "temperature_2m_min", "precipitation_sum"],
-    "hourly": ["temperature_2m", "precipitation"],
-    "timezone": "Europe/Berlin",
-}
-responses = openmeteo.weather_api(url, params=params)
-
-# Process first location. Add a for-loop for multiple locations or weather models
-response = responses[0]
-# Process hourly data. The order of variables needs to be the same as requested.
-hourly = response.Hourly()
-hourly_temperature_2m = hourly.Variables(0).ValuesAsNumpy()
-hourly_precipitation = hourly.Variables(1).ValuesAsNumpy()
-
-hourly_data = {"date": pd.date_range(
-    start = pd.to_datetime(hourly.Time(), unit = "s", utc = True),
-    end =  pd.to_datetime(hourly.TimeEnd(), unit = "s", utc = True),
-    freq = pd.Timedelta(seconds = hourly.Interval()),
-    inclusive = "left"
-)}
-
-hourly_data["temperature_2m"] = hourly_temperature_2m
-hourly_data["precipitation"] = hourly_precipitation
-
-hourly_dataframe = pd.DataFrame(data = hourly_data)
-
-# Process daily data. The order of variables needs to be the same as requested.
-daily = response.Daily()
-daily_temperature_2m_max = daily.Variables(0).ValuesAsNumpy()
-daily_temperature_2m_min = daily.Variables(1).ValuesAsNumpy()
-daily_precipitation_sum = daily.Variables(2).ValuesAsNumpy()
-
-daily_data = {"date": pd.date_range(
-    start = pd.to_datetime(daily.Time(), unit = "s", utc = True),
-    end =  pd.to_datetime(daily.TimeEnd(), unit = "s", utc = True),
-    freq = pd.Timedelta(seconds = daily.Interval()),
-    inclusive = "left"
-)}
-
-daily_data["temperature_2m_max"] = daily_temperature_2m_max
-daily_data["temperature_2m_min"] = daily_temperature_2m_min
-daily_data["precipitation_sum"] = daily_precipitation_sum
-
-daily_dataframe = pd.DataFrame(data = daily_data)
-
-cet = pytz.timezone('CET')
-hourly_dataframe['date'] = hourly_dataframe['date'].dt.tz_convert(cet)
-daily_dataframe['date'] = daily_dataframe['date'].dt.tz_convert(cet)
-
-
-with sqlite3.connect('weather_display.sqlite') as db:
-    hourly_dataframe.to_sql('open_meteo_hourly', db, if_exists='replace', index=False)
-    daily_dataframe.to_sql('open_meteo_daily', db, if_exists='replace', index=False)
-
-    db.execute('UPDATE times SET time = ? WHERE item = ?', (datetime.now(cet), 'open_meteo'))
\ No newline at end of file
+import startup
+import steps
+import store
+
+# The forecast is only downloaded when this model has published a run newer
+# than the one already stored. The model's metadata says when the next run is
+# due, so the next check can be scheduled just after it lands.
+META_PATH = "/data/{model}/static/meta.json"
+UPDATE_MODEL = 'dwd_icon'
+RUN_DELAY = 120
+RECHECK_SECONDS = 600
+
+FORECAST_PATH = "/v1/forecast"
+
+# Each location's forecast days, almanac and display clock are in its own
+# timezone, set with timezone under [location] or [[locations]]
+DEFAULT_TIMEZONE = 'Europe/Brussels'
+
+# The requests forecast_update yields
+META = 'meta'
+FORECAST = 'forecast'
+
+# [open_meteo] api_url replaces the base URL, e.g. to use stub_server.py
+API_URL = "https://api.open-meteo.com"
+
+def api_url(config, path):
+    return config.get('open_meteo', {}).get('api_url', API_URL) + path
+
+def create_session():
+    import requests
+    from retry_requests import retry
+
+    # Retry on error. There is no response cache: new model runs are
+    # detected from the model metadata instead.
+    return retry(requests.Session(), retries = 5, backoff_factor = 0.2)
+
+def create_client(session):
+    import openmeteo_requests
+
+    return openmeteo_requests.Client(session = session)
+
+def locations(config):
+    # The display's own location, then any others listed under [[locations]]
+    home = dict(config['location'])
+    home.setdefault('name', store.DEFAULT_LOCATION)
+    return [home] + [location for location in config.get('locations', []) if location['name'] != home['name']]
+
+def timezone_name(location):
+    return location.get('timezone', DEFAULT_TIMEZONE)
+
+def timezone(location):
+    return pytz.timezone(timezone_name(location))
+
+def forecast_params(config):
+    # All locations go in one request. The variables are decoded in the
+    # order they are listed here.
+    sites = locations(config)
+    return {
+        "latitude": [site['latitude'] for site in sites],
+        "longitude": [site['longitude'] for site in sites],
+        "daily": store.DAILY_COLUMNS,
+        "hourly": store.HOURLY_COLUMNS,
+        "timezone": [timezone_name(site) for site in sites],
+    }
+
+def decode(section, columns):
+    import numpy as np
+
+    data = {'date': np.arange(section.Time(), section.TimeEnd(), section.Interval()).tolist()}
+    for index, column in enumerate(columns):
+        data[column] = section.Variables(index).ValuesAsNumpy().tolist()
+    return data
+
+def parse_forecast(responses):
+    # One response per location, in the order they were requested
+    return [(decode(response.Hourly(), store.HOURLY_COLUMNS), decode(response.Daily(), store.DAILY_COLUMNS))
+            for response in responses]
+
+def save_forecast(db, forecasts, config):
+    retention_days = config.get('store', {}).get('retention_days', store.RETENTION_DAYS)
+    for location, (hourly, daily) in zip(locations(config), forecasts):
+        store.save_forecast(db, location['name'], hourly, daily, retention_days)
+    store.set_time(db, 'open_meteo', str(datetime.now(timezone(config['location']))))
+
+def fetch_model_meta(session, url):
+    response = session.get(url, timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+def next_check(meta, now):
+    expected = meta['last_run_availability_time'] + meta['update_interval_seconds'] + RUN_DELAY
+    return expected if expected > now else now + RECHECK_SECONDS
+
+def update_model(config):
+    return config.get('open_meteo', {}).get('update_model', UPDATE_MODEL)
+
+def is_new_run(db, meta):
+    last_run = store.get_time(db, 'open_meteo_model_run')
+    return last_run is None or meta['last_run_initialisation_time'] > int(last_run)
+
+def record_run(db, meta):
+    store.set_time(db, 'open_meteo_model_run', str(meta['last_run_initialisation_time']))
+
+def report_no_run(meta, model, tz):
+    model_run = datetime.fromtimestamp(meta['last_run_initialisation_time'], tz)
+    print(f'  No new {model} run since {model_run:%Y-%m-%d %H:%M}')
+
+def forecast_update(db, config):
+    # Yields (META, url, None) for the model's metadata and (FORECAST, url,
+    # params) for the forecast, and is sent the decoded metadata or the
+    # forecast responses. Returns whether a new forecast was stored and when
+    # to check again.
+    now = time.time()
+    model = update_model(config)
+    forecast_request = (FORECAST, api_url(config, FORECAST_PATH), forecast_params(config))
+
+    if not model:
+        save_forecast(db, parse_forecast((yield forecast_request)), config)
+        return (True, (now // 3600 + 1) * 3600)
+
+    meta = yield (META, api_url(config, META_PATH.format(model=model)), None)
+
+    updated = is_new_run(db, meta)
+    if updated:
+        save_forecast(db, parse_forecast((yield forecast_request)), config)
+        record_run(db, meta)
+    else:
+        report_no_run(meta, model, timezone(config['location']))
+
+    return (updated, next_check(meta, now))
+
+def update_forecast(openmeteo, session, db, config):
+    def send(request):
+        kind, url, params = request
+        if kind == FORECAST:
+            return openmeteo.weather_api(url, params=params)
+        return fetch_model_meta(session, url)
+
+    return steps.run(forecast_update(db, config), send)
+
+def main():
+    with open('config.toml') as cin:
+        config = toml.loads(cin.read())
+
+    session = create_session()
+    db = store.connect()
+    update_forecast(create_client(session), session, db, config)
+    db.close()
+
+if __name__ == '__main__':
+    startup.profile_startup()
+    main()
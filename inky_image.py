@@ -1,35 +1,211 @@
 #!/usr/bin/env python3
 
 import argparse
+import os
 import pathlib
 import sys
+import time
 
+import numpy as np
+import toml
 from PIL import Image
 
-from inky.auto import auto
+import metrics
+import startup
 
-parser = argparse.ArgumentParser()
+LAST_FRAME_FILE = 'last_frame.npy'
 
-parser.add_argument("--saturation", "-s", type=float, default=0.5, help="Colour palette saturation")
-parser.add_argument("--file", "-f", type=pathlib.Path, help="Image file")
+# Images are quantised to the panel's palette here rather than by the Inky
+# driver. A lookup table maps every colour, at LUT_BITS per channel, to its
+# nearest palette entry, and an optional ordered dither shades the colours in
+# between. Pixels that are already a palette colour are never dithered, so
+# text, lines and flat fills stay solid. The result is handed to the driver as
+# a palette image, which it uses as is. Ordered dithering is local, so a change
+# to one panel does not ripple through the rest of the frame as error
+# diffusion would.
+LUT_BITS = 6
+DITHER_STRENGTH = 128
+BAYER = (np.array([[0, 8, 2, 10],
+                   [12, 4, 14, 6],
+                   [3, 11, 1, 9],
+                   [15, 7, 13, 5]]) + 0.5) / 16 - 0.5
 
-inky = auto(ask_user=True, verbose=True)
+_luts = {}
+_last_quantised = (None, None)
 
-args, _ = parser.parse_known_args()
+def get_inky():
+    from inky.auto import auto
 
-saturation = args.saturation
+    return auto(ask_user=True, verbose=True)
 
-if not args.file:
-    print(f"""Usage:
-    {sys.argv[0]} --file image.png (--saturation 0.5)""")
-    sys.exit(1)
+def load_last_frame():
+    if os.path.exists(LAST_FRAME_FILE):
+        return np.load(LAST_FRAME_FILE), os.path.getmtime(LAST_FRAME_FILE)
+    return None, 0
 
-image = Image.open(args.file)
-resizedimage = image.resize(inky.resolution)
+def save_last_frame(frame):
+    tmp_file = f'{LAST_FRAME_FILE}.tmp'
+    with open(tmp_file, 'wb') as f:
+        np.save(f, frame)
+    os.replace(tmp_file, LAST_FRAME_FILE)
 
-try:
-    inky.set_image(resizedimage, saturation=saturation)
-except TypeError:
-    inky.set_image(resizedimage)
+def ignore_mask(shape, boxes, layout_size):
+    # The pixels of frame covered by boxes given in layout coordinates
+    mask = np.zeros(shape, dtype=bool)
+    scale = (shape[1] / layout_size[0], shape[0] / layout_size[1])
+    for x, y, width, height in boxes:
+        left, top = round(x * scale[0]), round(y * scale[1])
+        mask[top:round((y + height) * scale[1]), left:round((x + width) * scale[0])] = True
+    return mask
 
-inky.show()
+def needs_refresh(frame, settings, ignore=None):
+    # ignore masks pixels that change on every render, such as the clock,
+    # and do not count as a change on their own
+    last_frame, last_refresh = load_last_frame()
+
+    if last_frame is None or last_frame.shape != frame.shape:
+        return True
+
+    # Clear any ghosting with a full refresh every so often, changed or not
+    if time.time() - last_refresh >= settings.get('full_refresh_interval', 21600):
+        return True
+
+    changed = last_frame != frame
+    if ignore is not None:
+        changed &= ~ignore
+    changed_pixels = np.count_nonzero(changed)
+    return changed_pixels > settings.get('min_changed_pixels', 0)
+
+def get_palette(inky, saturation):
+    # Drivers without a blended palette (the two and three colour displays)
+    # quantise for themselves
+    if not hasattr(inky, '_palette_blend'):
+        return None
+    return np.array(inky._palette_blend(saturation), dtype=np.uint8).reshape(-1, 3)
+
+def palette_lut(palette):
+    key = palette.tobytes()
+    if key not in _luts:
+        levels = 1 << LUT_BITS
+        centres = (np.arange(levels, dtype=np.int32) << (8 - LUT_BITS)) + (1 << (7 - LUT_BITS))
+
+        # Squared distance from each level to each palette entry, per channel.
+        # The table is filled a red level at a time, so the distances never
+        # take more than levels^2 x palette entries, rather than being
+        # broadcast over the whole grid at once.
+        channel = (centres[:, np.newaxis, np.newaxis] - palette.astype(np.int32).T[np.newaxis]) ** 2
+        green_blue = channel[:, np.newaxis, 1] + channel[np.newaxis, :, 2]
+
+        # Ties go to the first entry, so duplicate entries such as the
+        # 'clean' colour are never used
+        lut = np.empty((levels, levels * levels), dtype=np.uint8)
+        for red in range(levels):
+            lut[red] = (green_blue + channel[red, 0]).argmin(axis=-1).ravel()
+        _luts[key] = lut.ravel()
+
+    return _luts[key]
+
+def lut_index(pixels):
+    shift = 8 - LUT_BITS
+    channels = (pixels >> shift).astype(np.uint32)
+    return (channels[..., 0] << (2 * LUT_BITS)) | (channels[..., 1] << LUT_BITS) | channels[..., 2]
+
+def pack(pixels):
+    pixels = pixels.astype(np.uint32)
+    return (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+
+def quantise(image, palette, dither='ordered'):
+    # Returns palette indices for each pixel. The last result is kept, so an
+    # unchanged image is not quantised twice.
+    global _last_quantised
+
+    pixels = np.asarray(image.convert('RGB'))
+    key = (hash(pixels.tobytes()), palette.tobytes(), dither)
+    if _last_quantised[0] == key:
+        return _last_quantised[1]
+
+    lut = palette_lut(palette)
+    frame = lut[lut_index(pixels)]
+
+    if dither == 'ordered':
+        height, width = pixels.shape[:2]
+        threshold = np.tile(BAYER * DITHER_STRENGTH, (height // 4 + 1, width // 4 + 1))[:height, :width]
+        shaded = np.clip(pixels + threshold[..., np.newaxis].astype(np.int16), 0, 255)
+
+        exact = pack(pixels) == pack(palette)[frame]
+        frame = np.where(exact, frame, lut[lut_index(shaded)])
+
+    _last_quantised = (key, frame)
+    return frame
+
+def palette_image(frame, palette):
+    image = Image.fromarray(frame, 'P')
+    image.putpalette(palette.ravel().tolist())
+    return image
+
+def show_image(inky, image, saturation, settings=None, force=False, ignore=(), layout_size=None):
+    # ignore lists boxes, in layout_size coordinates, left out of the
+    # unchanged frame check
+    settings = settings or {}
+    resizedimage = image if image.size == inky.resolution else image.resize(inky.resolution)
+
+    palette = get_palette(inky, saturation)
+    if palette is not None:
+        with metrics.span('quantise'):
+            resizedimage = palette_image(quantise(resizedimage, palette, settings.get('dither', 'ordered')), palette)
+
+    with metrics.span('inky_set_image'):
+        try:
+            inky.set_image(resizedimage, saturation=saturation)
+        except TypeError:
+            inky.set_image(resizedimage)
+
+    # inky.buf holds the image after quantisation to the panel palette,
+    # so this only compares what would actually change on the screen
+    frame = np.array(inky.buf, dtype=np.uint8)
+
+    mask = ignore_mask(frame.shape, ignore, layout_size or image.size) if ignore else None
+    if not force and not needs_refresh(frame, settings, mask):
+        print('  Display unchanged; skipping refresh')
+        return False
+
+    with metrics.span('inky_refresh'):
+        inky.show()
+    save_last_frame(frame)
+    return True
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--saturation", "-s", type=float, default=0.5, help="Colour palette saturation")
+    parser.add_argument("--file", "-f", type=pathlib.Path, help="Image file")
+    parser.add_argument("--force", action="store_true", help="Refresh the display even if the image has not changed")
+    parser.add_argument("--ignore-clock", action="store_true",
+                        help="Leave the display's clock out of the unchanged image check")
+
+    inky = get_inky()
+
+    args, _ = parser.parse_known_args()
+
+    if not args.file:
+        print(f"""Usage:
+    {sys.argv[0]} --file image.png (--saturation 0.5) (--force) (--ignore-clock)""")
+        sys.exit(1)
+
+    settings = {}
+    if os.path.exists('config.toml'):
+        with open('config.toml') as cin:
+            settings = toml.loads(cin.read()).get('inky', {})
+
+    ignore = {}
+    if args.ignore_clock:
+        import display
+
+        # The clock changes on every render, so it alone does not refresh the display
+        ignore = {'ignore': [display.PANELS['timestamp']], 'layout_size': (display.WIDTH, display.HEIGHT)}
+
+    show_image(inky, Image.open(args.file), args.saturation, settings, args.force, **ignore)
+
+if __name__ == '__main__':
+    startup.profile_startup()
+    main()
@@ -0,0 +1,158 @@
+import glob
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+import drawsvg as draw
+import numpy as np
+
+import assets
+import metrics
+
+# Each panel of the display is drawn into its own layer, which covers the
+# panel's box in the 800x480 layout. The layer's viewBox starts at the box's
+# corner, so panels draw in layout coordinates as before. Layers are
+# rasterised at their final pixel size and composited onto the frame with
+# PIL. Icons come pre-rasterised from the asset cache and are pasted in the
+# same way, rather than embedded in the SVG and parsed again for every frame.
+#
+# A layer is only drawn when it is needed. Layers with inputs are cached on
+# disk, keyed on a hash of the panel, its inputs and the drawing code, so a
+# panel whose data has not changed is loaded rather than drawn and
+# rasterised again.
+
+FONT_FAMILY = 'Noto Sans Mono'
+PANEL_CACHE_DIR = 'panel_cache'
+
+# Changes to any of these invalidate the panel cache
+CODE_FILES = ['display.py', 'chart.py', 'gauge.py', 'colors.py', 'layers.py']
+
+@lru_cache(maxsize=None)
+def code_version():
+    digest = hashlib.sha1()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in CODE_FILES:
+        with open(os.path.join(directory, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def _hash_value(digest, value):
+    if isinstance(value, np.ndarray):
+        digest.update(f'array {value.dtype} {value.shape}'.encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        digest.update(b'{')
+        for key in sorted(value):
+            _hash_value(digest, key)
+            _hash_value(digest, value[key])
+        digest.update(b'}')
+    elif isinstance(value, (list, tuple)):
+        digest.update(b'(')
+        for item in value:
+            _hash_value(digest, item)
+        digest.update(b')')
+    else:
+        digest.update(repr(value).encode() + b'\0')
+
+def input_hash(*values):
+    digest = hashlib.sha1(code_version().encode())
+    _hash_value(digest, values)
+    return digest.hexdigest()[:20]
+
+class Layer:
+    # draw_function(layer, *inputs) draws the panel. Without cache=True
+    # the layer is drawn every time, e.g. for the clock.
+    def __init__(self, name, x, y, width, height, draw_function, inputs=(), cache=True):
+        self.name = name
+        self.box = (x, y, width, height)
+        self.draw_function = draw_function
+        self.inputs = inputs
+        self.key = input_hash(name, self.box, inputs) if cache else None
+        self.drawing = None
+        self.icons = []
+
+    def render(self):
+        x, y, width, height = self.box
+        self.drawing = draw.Drawing(width, height, origin=(x, y), font_family=FONT_FAMILY,
+                                    preserveAspectRatio='none')
+        self.icons = []
+
+        with metrics.span(f'panel_{self.name}'):
+            self.draw_function(self, *self.inputs)
+
+    def append(self, element):
+        self.drawing.append(element)
+
+    def icon(self, x, y, size, path):
+        self.icons.append((x, y, size, path))
+
+def rasterize(svg, size):
+    # Render straight into a cairo image surface at the requested size and hand
+    # its pixels to PIL, without encoding and decoding a PNG on the way. cairo's
+    # pixels have premultiplied alpha, which the BGRa raw mode undoes.
+    from cairosvg.parser import Tree
+    from cairosvg.surface import PNGSurface
+    from PIL import Image
+
+    surface = PNGSurface(Tree(bytestring=svg), None, 96, output_width=size[0], output_height=size[1])
+    surface.cairo.flush()
+
+    return Image.frombuffer('RGBA', (surface.width, surface.height), surface.cairo.get_data(),
+                            'raw', 'BGRa', surface.cairo.get_stride(), 1)
+
+def cache_file(cache_dir, layer, size, key):
+    return os.path.join(cache_dir, f'{layer.name}-{size[0]}x{size[1]}-{key}.png')
+
+def layer_pixels(layer, size, cache_dir):
+    # Returns the layer rasterised at size and its icons. The icons are kept
+    # with the cached pixels, as they are pasted from the asset cache.
+    from PIL import Image, PngImagePlugin
+
+    filename = None
+    if cache_dir and layer.key:
+        filename = cache_file(cache_dir, layer, size, layer.key)
+        if os.path.exists(filename):
+            with Image.open(filename) as image:
+                return (image.convert('RGBA'), [tuple(icon) for icon in json.loads(image.info['icons'])])
+
+    layer.render()
+    pixels = rasterize(layer.drawing.as_svg().encode(), size)
+
+    if filename:
+        os.makedirs(cache_dir, exist_ok=True)
+        for stale in glob.glob(cache_file(cache_dir, layer, size, '*')):
+            os.remove(stale)
+
+        info = PngImagePlugin.PngInfo()
+        info.add_text('icons', json.dumps(layer.icons))
+        tmp_file = f'{filename}.{os.getpid()}.tmp'
+        pixels.save(tmp_file, format='PNG', pnginfo=info)
+        os.replace(tmp_file, filename)
+
+    return (pixels, layer.icons)
+
+def scale_box(box, scale):
+    x, y, width, height = box
+    left = round(x * scale[0])
+    top = round(y * scale[1])
+    return (left, top, round((x + width) * scale[0]) - left, round((y + height) * scale[1]) - top)
+
+def composite(layers, layout_size, size, background='white', cache_dir=PANEL_CACHE_DIR):
+    from PIL import Image
+
+    scale = (size[0] / layout_size[0], size[1] / layout_size[1])
+    image = Image.new('RGB', size, background)
+
+    for layer in layers:
+        with metrics.span(f'raster_{layer.name}'):
+            left, top, width, height = scale_box(layer.box, scale)
+            pixels, icons = layer_pixels(layer, (width, height), cache_dir)
+            image.paste(pixels, (left, top), pixels)
+
+            for x, y, icon_size, path in icons:
+                left, top, width, height = scale_box((x, y, icon_size, icon_size), scale)
+                icon = assets.icon(path, (width, height))
+                image.paste(icon, (left, top), icon)
+
+    return image
@@ -0,0 +1,104 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Timings for each stage of a cycle. Code marks a stage with
+#
+#     with metrics.span('netatmo_fetch'):
+#         ...
+#
+# and the daemon writes what was recorded at the end of each cycle, along
+# with the process's CPU time and peak RSS. Stages that run more than once
+# in a cycle are added together. [metrics] in the config chooses the outputs:
+# a JSON lines file with one record per cycle, and/or a Prometheus textfile
+# for node_exporter's textfile collector.
+
+PREFIX = 'weather_display'
+
+_lock = threading.Lock()
+_spans = {}
+_cycle_start = (time.time(), time.perf_counter(), time.process_time())
+
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            total, count = _spans.get(name, (0.0, 0))
+            _spans[name] = (total + elapsed, count + 1)
+
+def start_cycle():
+    global _cycle_start
+
+    with _lock:
+        _spans.clear()
+        _cycle_start = (time.time(), time.perf_counter(), time.process_time())
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def cycle_record():
+    started, perf_start, cpu_start = _cycle_start
+    with _lock:
+        spans = {name: {'seconds': round(total, 6), 'count': count} for name, (total, count) in _spans.items()}
+
+    return {
+        'time': int(started),
+        'duration': round(time.perf_counter() - perf_start, 6),
+        'cpu_seconds': round(time.process_time() - cpu_start, 6),
+        'cpu_seconds_total': round(time.process_time(), 6),
+        'peak_rss_bytes': peak_rss_bytes(),
+        'spans': spans,
+    }
+
+def prometheus_text(record):
+    lines = [
+        f'# HELP {PREFIX}_stage_seconds Time spent in each stage in the last cycle',
+        f'# TYPE {PREFIX}_stage_seconds gauge',
+    ]
+    lines += [f'{PREFIX}_stage_seconds{{stage="{name}"}} {span["seconds"]}' for name, span in record['spans'].items()]
+
+    lines += [
+        f'# HELP {PREFIX}_cycle_seconds Duration of the last cycle',
+        f'# TYPE {PREFIX}_cycle_seconds gauge',
+        f'{PREFIX}_cycle_seconds {record["duration"]}',
+        f'# HELP {PREFIX}_cycle_timestamp_seconds Start time of the last cycle',
+        f'# TYPE {PREFIX}_cycle_timestamp_seconds gauge',
+        f'{PREFIX}_cycle_timestamp_seconds {record["time"]}',
+        f'# HELP {PREFIX}_cpu_seconds_total CPU time used by the process',
+        f'# TYPE {PREFIX}_cpu_seconds_total counter',
+        f'{PREFIX}_cpu_seconds_total {record["cpu_seconds_total"]}',
+        f'# HELP {PREFIX}_peak_rss_bytes Peak resident set size of the process',
+        f'# TYPE {PREFIX}_peak_rss_bytes gauge',
+        f'{PREFIX}_peak_rss_bytes {record["peak_rss_bytes"]}',
+    ]
+
+    return '\n'.join(lines) + '\n'
+
+def finish_cycle(config):
+    settings = config.get('metrics', {})
+    record = cycle_record()
+
+    jsonl = settings.get('jsonl')
+    if jsonl:
+        with open(jsonl, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    # The collector may read the file at any moment, so replace it whole
+    textfile = settings.get('textfile')
+    if textfile:
+        tmp_file = f'{textfile}.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(prometheus_text(record))
+        os.replace(tmp_file, textfile)
+
+    return record
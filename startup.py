@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+
+# Run an entry point with --profile-startup to see where its cold-start time
+# goes. The script is re-run in a child interpreter with -X importtime and the
+# import times it reports are summarised when it exits.
+
+FLAG = '--profile-startup'
+ENV = 'WEATHER_PROFILE_STARTUP'
+TOP_N = 25
+
+def profiling():
+    return os.environ.get(ENV) == '1'
+
+def parse_importtime(lines):
+    imports = []
+    for line in lines:
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        imports.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+
+    return imports
+
+def report(imports):
+    packages = {}
+    for name, depth, self_us, cumulative_us in imports:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+
+    total = sum(packages.values())
+
+    print('')
+    print(f'Startup import time: {total / 1000:.1f} ms in {len(imports)} modules')
+    print('')
+    print(f'{"package":<30} {"ms":>9} {"%":>6}')
+    for package, self_us in sorted(packages.items(), key=lambda p: p[1], reverse=True)[:TOP_N]:
+        print(f'{package:<30} {self_us / 1000:>9.1f} {self_us / total * 100:>6.1f}')
+
+    print('')
+    print(f'{"module (imported directly)":<30} {"ms":>9}')
+    direct = [i for i in imports if i[1] == 0]
+    for name, depth, self_us, cumulative_us in sorted(direct, key=lambda i: i[3], reverse=True)[:TOP_N]:
+        print(f'{name:<30} {cumulative_us / 1000:>9.1f}')
+
+def profile_startup():
+    if FLAG not in sys.argv:
+        return
+
+    argv = [arg for arg in sys.argv if arg != FLAG]
+    env = dict(os.environ, **{ENV: '1'})
+    child = subprocess.Popen([sys.executable, '-X', 'importtime'] + argv, env=env,
+                             stderr=subprocess.PIPE, text=True)
+
+    lines = []
+    for line in child.stderr:
+        if line.startswith('import time:'):
+            lines.append(line)
+        else:
+            sys.stderr.write(line)
+
+    returncode = child.wait()
+    report(parse_importtime(lines))
+    sys.exit(returncode)
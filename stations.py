@@ -0,0 +1,98 @@
+import json
+import os
+
+# The getstationsdata response parsed once per fetch into a flat model:
+#
+#     stations  station ID -> name, last upload time and its module IDs,
+#               the station's own (NAMain) module first
+#     modules   module ID -> station ID, type, name, battery and the
+#               latest dashboard data
+#     types     module type (NAMain, NAModule1..4) -> module IDs
+#
+# The model is what gets saved between runs, without the rest of the
+# response, and what the display reads its modules from.
+
+STATIONS_FILE = 'netatmo_stations.json'
+
+# The module types each role on the display is filled from by default
+ROLES = {
+    'outdoor': 'NAModule1',
+    'rain': 'NAModule3',
+    'indoor': 'NAModule4',
+}
+
+# getmeasure types and the dashboard readings they correspond to
+DASHBOARD_KEYS = {
+    'temperature': 'Temperature',
+    'humidity': 'Humidity',
+    'co2': 'CO2',
+    'pressure': 'Pressure',
+    'noise': 'Noise',
+    'rain': 'Rain',
+    'windstrength': 'WindStrength',
+    'windangle': 'WindAngle',
+    'guststrength': 'GustStrength',
+    'gustangle': 'GustAngle',
+}
+
+def build(data):
+    model = {'stations': {}, 'modules': {}, 'types': {}}
+
+    for device in data['devices']:
+        ids = []
+        for module in [device] + device.get('modules', []):
+            dashboard = module.get('dashboard_data', {})
+            model['modules'][module['_id']] = {
+                'station': device['_id'],
+                'type': module['type'],
+                'name': module.get('module_name'),
+                'battery': module.get('battery_vp'),
+                'time': dashboard.get('time_utc'),
+                'data': dashboard,
+            }
+            model['types'].setdefault(module['type'], []).append(module['_id'])
+            ids.append(module['_id'])
+
+        model['stations'][device['_id']] = {
+            'name': device.get('station_name'),
+            'last_upload': device.get('last_status_store', device.get('dashboard_data', {}).get('time_utc', 0)),
+            'modules': ids,
+        }
+
+    return model
+
+def save(model, path=STATIONS_FILE):
+    tmp_file = f'{path}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(model, f, separators=(',', ':'))
+    os.replace(tmp_file, path)
+
+def load(path=STATIONS_FILE):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return None
+
+def measurement_times(model):
+    return {module_id: module['time'] for module_id, module in model['modules'].items()}
+
+def module_of_type(model, station_id, type):
+    return next((model['modules'][module_id] for module_id in model['stations'][station_id]['modules']
+                 if model['modules'][module_id]['type'] == type), None)
+
+def select(model, settings):
+    # Returns the modules shown on the display by role. [display] station
+    # and <role>_module name them by ID; by default the first station is
+    # used with its first module of each role's type.
+    station_id = settings.get('station') or next(iter(model['stations']))
+
+    selected = {'main': model['modules'][station_id]}
+    for role, type in ROLES.items():
+        module_id = settings.get(f'{role}_module')
+        selected[role] = model['modules'][module_id] if module_id else module_of_type(model, station_id, type)
+
+    return selected
+
+def dashboard(module):
+    # The module's latest readings, with its battery level alongside
+    return dict(module['data'], battery=module['battery'])
@@ -0,0 +1,22 @@
+# Update logic shared by the scripts and the daemon's async fetcher is written
+# as generators that yield each request they need and are sent its response.
+# The decisions, paging and storing live in one place, and each caller only
+# supplies the transport: requests in the scripts, niquests' async session in
+# the daemon.
+
+def run(steps, send):
+    # Returns the generator's return value
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(send(request))
+    except StopIteration as stop:
+        return stop.value
+
+async def run_async(steps, send):
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(await send(request))
+    except StopIteration as stop:
+        return stop.value
@@ -0,0 +1,219 @@
+import sqlite3
+import time
+
+import metrics
+
+# SQLite store shared by the fetchers and the renderer. WAL mode lets the
+# renderer read while a fetcher is writing. Forecast rows are keyed on their
+# location's name and timestamp (epoch seconds, UTC) and upserted, so each
+# fetch updates the hours it covers and earlier hours are kept as history
+# until they pass the retention period.
+#
+# Netatmo measurements are stored one value per row, keyed on module, type
+# and time, and are kept indefinitely.
+#
+# The sun almanac has a row per location and local day (the date's ordinal),
+# with the times of its events in epoch seconds. A location's position is
+# kept alongside, so its almanac can be regenerated when it moves.
+
+DB_FILE = 'weather_display.sqlite'
+RETENTION_DAYS = 30
+DEFAULT_LOCATION = 'home'
+
+HOURLY_COLUMNS = ['temperature_2m', 'precipitation']
+DAILY_COLUMNS = ['temperature_2m_max', 'temperature_2m_min', 'precipitation_sum']
+ALMANAC_COLUMNS = ['dawn', 'sunrise', 'sunset', 'dusk', 'daylight']
+
+SCHEMA = [
+    # Version 1
+    '''
+    CREATE TABLE IF NOT EXISTS forecast_hourly (
+        date INTEGER PRIMARY KEY,
+        temperature_2m REAL,
+        precipitation REAL,
+        updated INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS forecast_daily (
+        date INTEGER PRIMARY KEY,
+        temperature_2m_max REAL,
+        temperature_2m_min REAL,
+        precipitation_sum REAL,
+        updated INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS times (
+        item TEXT,
+        time TEXT
+    );
+    ''',
+    # Version 2
+    '''
+    CREATE TABLE IF NOT EXISTS netatmo_measures (
+        module_id TEXT NOT NULL,
+        type TEXT NOT NULL,
+        time INTEGER NOT NULL,
+        value REAL,
+        PRIMARY KEY (module_id, type, time)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS netatmo_measures_time ON netatmo_measures (module_id, time);
+    ''',
+    # Version 3: forecasts for several locations
+    '''
+    CREATE TABLE forecast_hourly_new (
+        location TEXT NOT NULL,
+        date INTEGER NOT NULL,
+        temperature_2m REAL,
+        precipitation REAL,
+        updated INTEGER NOT NULL,
+        PRIMARY KEY (location, date)
+    ) WITHOUT ROWID;
+    INSERT INTO forecast_hourly_new
+        SELECT 'home', date, temperature_2m, precipitation, updated FROM forecast_hourly;
+    DROP TABLE forecast_hourly;
+    ALTER TABLE forecast_hourly_new RENAME TO forecast_hourly;
+
+    CREATE TABLE forecast_daily_new (
+        location TEXT NOT NULL,
+        date INTEGER NOT NULL,
+        temperature_2m_max REAL,
+        temperature_2m_min REAL,
+        precipitation_sum REAL,
+        updated INTEGER NOT NULL,
+        PRIMARY KEY (location, date)
+    ) WITHOUT ROWID;
+    INSERT INTO forecast_daily_new
+        SELECT 'home', date, temperature_2m_max, temperature_2m_min, precipitation_sum, updated FROM forecast_daily;
+    DROP TABLE forecast_daily;
+    ALTER TABLE forecast_daily_new RENAME TO forecast_daily;
+    ''',
+    # Version 4: sun almanac
+    '''
+    CREATE TABLE almanac (
+        location TEXT NOT NULL,
+        day INTEGER NOT NULL,
+        dawn INTEGER,
+        sunrise INTEGER,
+        sunset INTEGER,
+        dusk INTEGER,
+        daylight INTEGER,
+        PRIMARY KEY (location, day)
+    ) WITHOUT ROWID;
+    CREATE TABLE almanac_locations (
+        location TEXT PRIMARY KEY,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        timezone TEXT NOT NULL
+    );
+    ''',
+]
+
+def connect(path=DB_FILE):
+    db = sqlite3.connect(path, timeout=30)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    migrate(db)
+    return db
+
+def migrate(db):
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+    for number, script in enumerate(SCHEMA[version:], start=version + 1):
+        with db:
+            db.executescript(script)
+            db.execute(f'PRAGMA user_version = {number}')
+
+def set_time(db, item, value):
+    with db:
+        if db.execute('UPDATE times SET time = ? WHERE item = ?', (value, item)).rowcount == 0:
+            db.execute('INSERT INTO times (item, time) VALUES (?, ?)', (item, value))
+
+def get_time(db, item):
+    row = db.execute('SELECT time FROM times WHERE item = ?', (item,)).fetchone()
+    return row[0] if row else None
+
+def _upsert(db, table, columns, location, data, updated):
+    names = ', '.join(['location', 'date'] + columns + ['updated'])
+    placeholders = ', '.join(['?'] * (len(columns) + 3))
+    updates = ', '.join(f'{column} = excluded.{column}' for column in columns + ['updated'])
+
+    count = len(data['date'])
+    rows = zip([location] * count, data['date'], *[data[column] for column in columns], [updated] * count)
+    db.executemany(f'INSERT INTO {table} ({names}) VALUES ({placeholders}) '
+                   f'ON CONFLICT (location, date) DO UPDATE SET {updates}', rows)
+
+def save_forecast(db, location, hourly, daily, retention_days=RETENTION_DAYS):
+    # hourly and daily map column names to sequences, with 'date' in epoch seconds
+    now = int(time.time())
+    cutoff = now - retention_days * 86400
+
+    with metrics.span('sqlite_write'), db:
+        _upsert(db, 'forecast_hourly', HOURLY_COLUMNS, location, hourly, now)
+        _upsert(db, 'forecast_daily', DAILY_COLUMNS, location, daily, now)
+
+        db.execute('DELETE FROM forecast_hourly WHERE location = ? AND date < ?', (location, cutoff))
+        db.execute('DELETE FROM forecast_daily WHERE location = ? AND date < ?', (location, cutoff))
+
+def hourly_query(location, start, end):
+    return (f'SELECT date, {", ".join(HOURLY_COLUMNS)} FROM forecast_hourly '
+            'WHERE location = ? AND date >= ? AND date <= ? ORDER BY date', (location, start, end))
+
+def daily_query(location, now, days):
+    # Days are stamped at local midnight, so the first day after 24 hours ago is today
+    return (f'SELECT date, {", ".join(DAILY_COLUMNS)} FROM forecast_daily '
+            'WHERE location = ? AND date > ? ORDER BY date LIMIT ?', (location, now - 86400, days))
+
+def read_columns(db, query, columns):
+    # Bulk-reads a forecast query into typed arrays: 'date' as int64 epoch
+    # seconds and each of columns as float32, with NULLs as NaN
+    import numpy as np
+
+    sql, params = query
+    rows = np.array(db.execute(sql, params).fetchall(), dtype=float).reshape(-1, len(columns) + 1)
+
+    arrays = {'date': rows[:, 0].astype(np.int64)}
+    for index, column in enumerate(columns, start=1):
+        arrays[column] = rows[:, index].astype(np.float32)
+    return arrays
+
+def last_measure_time(db, module_id):
+    row = db.execute('SELECT MAX(time) FROM netatmo_measures WHERE module_id = ?', (module_id,)).fetchone()
+    return row[0]
+
+def save_measures(db, module_id, types, rows):
+    # rows are (time, [value for each type]) pairs
+    values = [(module_id, type, timestamp, value)
+              for timestamp, measures in rows
+              for type, value in zip(types, measures)]
+
+    with metrics.span('sqlite_write'), db:
+        db.executemany('INSERT OR REPLACE INTO netatmo_measures (module_id, type, time, value) VALUES (?, ?, ?, ?)', values)
+
+def measure_times(db, module_id, start, end):
+    return [row[0] for row in db.execute('SELECT DISTINCT time FROM netatmo_measures '
+                                         'WHERE module_id = ? AND time >= ? AND time <= ? ORDER BY time',
+                                         (module_id, start, end))]
+
+def load_measures(db, module_id, type, start, end=None):
+    if end is None:
+        end = int(time.time())
+
+    return db.execute('SELECT time, value FROM netatmo_measures '
+                      'WHERE module_id = ? AND type = ? AND time >= ? AND time <= ? ORDER BY time',
+                      (module_id, type, start, end)).fetchall()
+
+def almanac_range(db, location):
+    # The position the location's almanac was generated for and the days it covers
+    return db.execute('SELECT l.latitude, l.longitude, l.timezone, MIN(a.day), MAX(a.day) '
+                      'FROM almanac_locations l LEFT JOIN almanac a ON a.location = l.location '
+                      'WHERE l.location = ? GROUP BY l.location', (location,)).fetchone()
+
+def save_almanac(db, location, latitude, longitude, timezone, rows):
+    # rows are (day, dawn, sunrise, sunset, dusk, daylight), and replace the location's almanac
+    with metrics.span('sqlite_write'), db:
+        db.execute('DELETE FROM almanac WHERE location = ?', (location,))
+        db.executemany(f'INSERT INTO almanac (location, day, {", ".join(ALMANAC_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       [(location, *row) for row in rows])
+        db.execute('INSERT OR REPLACE INTO almanac_locations (location, latitude, longitude, timezone) VALUES (?, ?, ?, ?)',
+                   (location, latitude, longitude, timezone))
+
+def load_almanac(db, location, first, last):
+    return db.execute(f'SELECT day, {", ".join(ALMANAC_COLUMNS)} FROM almanac '
+                      'WHERE location = ? AND day >= ? AND day <= ? ORDER BY day', (location, first, last)).fetchall()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+# Local stand-ins for the Netatmo and open-meteo APIs, so the whole fetch and
+# render cycle can run without network access or credentials. Start it with
+#
+#     python stub_server.py --port 8080
+#
+# and point the config at it:
+#
+#     [netatmo]
+#     api_url = 'http://127.0.0.1:8080'
+#     [open_meteo]
+#     api_url = 'http://127.0.0.1:8080'
+#
+# It issues tokens for any refresh token, replays the recorded station data in
+# fixtures/ stamped with the time of each request so every poll brings new
+# observations, and serves getmeasure history made from the recorded
+# readings. Forecasts are built as flatbuffers, like open-meteo's, from the
+# same curves as the benchmark's forecast fixture. --latency, --error-rate
+# and --rate-limit make it slow, flaky or rate limited.
+
+import argparse
+import copy
+import json
+import math
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytz
+
+import stations
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+NETATMO_FIXTURE = os.path.join(FIXTURES, 'netatmo_weather.json')
+
+PORT = 8080
+TOKEN_SECONDS = 10800
+MEASURE_INTERVAL = 300
+FORECAST_DAYS = 7
+
+# openmeteo_sdk Variable, Unit and Aggregation codes for each forecast column
+FORECAST_VARIABLES = {
+    'temperature_2m': (47, 1, 0),
+    'precipitation': (24, 32, 0),
+    'temperature_2m_max': (47, 1, 2),
+    'temperature_2m_min': (47, 1, 1),
+    'precipitation_sum': (24, 32, 10),
+}
+
+def hourly_series(hours, midnight):
+    # A daily temperature cycle and a few showers
+    return {
+        'temperature_2m': [round(10 + 5 * math.sin((t - midnight) / 86400 * 2 * math.pi - 2), 1) for t in hours],
+        'precipitation': [round(max(0, 1.5 * math.sin((t - midnight) / 20000)), 1) for t in hours],
+    }
+
+def daily_series(count):
+    return {
+        'temperature_2m_max': [14 + i % 3 for i in range(count)],
+        'temperature_2m_min': [5 + i % 4 for i in range(count)],
+        'precipitation_sum': [(0, 2.4, 0.3, 0, 7.1)[i % 5] for i in range(count)],
+    }
+
+def stations_body(data, now):
+    body = copy.deepcopy(data)
+    for device in body['devices']:
+        device['last_status_store'] = now
+        for module in [device] + device.get('modules', []):
+            module.setdefault('dashboard_data', {})['time_utc'] = now
+    return body
+
+def measure_body(data, params, now):
+    # With optimize=false, timestamp -> values in the order of the types
+    module_id = params.get('module_id', params['device_id'])
+    modules = [module for device in data['devices'] for module in [device] + device.get('modules', [])]
+    dashboard = next(module for module in modules if module['_id'] == module_id).get('dashboard_data', {})
+
+    types = params['type'].split(',')
+    first = math.ceil(int(params['date_begin']) / MEASURE_INTERVAL) * MEASURE_INTERVAL
+    times = range(first, now + 1, MEASURE_INTERVAL)[:int(params.get('limit', 1024))]
+
+    return {str(t): [dashboard.get(stations.DASHBOARD_KEYS.get(type)) for type in types] for t in times}
+
+def _variables(builder, columns, values):
+    offsets = []
+    for column in columns:
+        variable, unit, aggregation = FORECAST_VARIABLES[column]
+
+        builder.StartVector(4, len(values[column]), 4)
+        for value in reversed(values[column]):
+            builder.PrependFloat32(value)
+        vector = builder.EndVector()
+
+        builder.StartObject(13)
+        builder.PrependUint8Slot(0, variable, 0)
+        builder.PrependUint8Slot(1, unit, 0)
+        builder.PrependUOffsetTRelativeSlot(3, vector, 0)
+        builder.PrependUint8Slot(6, aggregation, 0)
+        offsets.append(builder.EndObject())
+
+    builder.StartVector(4, len(offsets), 4)
+    for offset in reversed(offsets):
+        builder.PrependUOffsetTRelative(offset)
+    return builder.EndVector()
+
+def _section(builder, columns, values, start, end, interval):
+    variables = _variables(builder, columns, values)
+
+    builder.StartObject(4)
+    builder.PrependInt64Slot(0, start, 0)
+    builder.PrependInt64Slot(1, end, 0)
+    builder.PrependInt32Slot(2, interval, 0)
+    builder.PrependUOffsetTRelativeSlot(3, variables, 0)
+    return builder.EndObject()
+
+def forecast_message(latitude, longitude, hourly_columns, daily_columns, timezone, now):
+    # One length-prefixed WeatherApiResponse, starting at local midnight
+    import flatbuffers
+
+    tz = pytz.timezone(timezone)
+    local_now = datetime.fromtimestamp(now, tz)
+    midnight = int(local_now.replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+    end = midnight + FORECAST_DAYS * 86400
+
+    hours = range(midnight, end, 3600)
+    hourly = hourly_series(hours, midnight)
+    daily = daily_series(FORECAST_DAYS)
+
+    builder = flatbuffers.Builder(4096)
+    timezone_name = builder.CreateString(timezone)
+    hourly_offset = _section(builder, hourly_columns, hourly, midnight, end, 3600)
+    daily_offset = _section(builder, daily_columns, daily, midnight, end, 86400)
+
+    builder.StartObject(14)
+    builder.PrependFloat32Slot(0, latitude, 0)
+    builder.PrependFloat32Slot(1, longitude, 0)
+    builder.PrependInt32Slot(6, int(local_now.utcoffset().total_seconds()), 0)
+    builder.PrependUOffsetTRelativeSlot(7, timezone_name, 0)
+    builder.PrependUOffsetTRelativeSlot(10, daily_offset, 0)
+    builder.PrependUOffsetTRelativeSlot(11, hourly_offset, 0)
+    builder.Finish(builder.EndObject())
+
+    message = bytes(builder.Output())
+    return len(message).to_bytes(4, 'little') + message
+
+def model_meta(now):
+    run = now // 3600 * 3600
+    return {
+        'last_run_initialisation_time': run,
+        'last_run_availability_time': run,
+        'update_interval_seconds': 3600,
+    }
+
+def _values(query, name):
+    # Lists come as repeated or comma-separated parameters
+    return [item for value in query.get(name, []) for item in value.split(',') if item]
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0, error_rate=0, rate_limit=0, seed=None, verbose=False):
+        super().__init__(address, StubHandler)
+
+        with open(NETATMO_FIXTURE) as f:
+            self.stations = json.load(f)
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.verbose = verbose
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.requests = []
+        self.tokens = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def fault(self, netatmo):
+        # Returns an error response to send instead, or None. Rate limits
+        # count the requests in the last minute.
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self.lock:
+            now = time.time()
+            self.requests = [t for t in self.requests if t > now - 60]
+            limited = self.rate_limit and len(self.requests) >= self.rate_limit
+            if not limited:
+                self.requests.append(now)
+            failed = self.random.random() < self.error_rate
+
+        if limited:
+            if netatmo:
+                return (403, {'error': {'code': 26, 'message': 'User usage reached'}})
+            return (429, {'error': True, 'reason': 'Minutely API request limit exceeded. Please try again in one minute.'})
+
+        if failed:
+            if netatmo:
+                return (500, {'error': {'code': 1, 'message': 'Internal error'}})
+            return (500, {'error': True, 'reason': 'Internal error'})
+
+        return None
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send(self, status, body, content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def query(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            for name, values in parse_qs(self.rfile.read(length).decode()).items():
+                query.setdefault(name, []).extend(values)
+
+        return (url.path, query)
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def handle_request(self):
+        path, query = self.query()
+        netatmo = path.startswith(('/api/', '/oauth2/'))
+
+        error = self.server.fault(netatmo)
+        if error:
+            self.send(*error)
+            return
+
+        now = int(time.time())
+
+        if path == '/oauth2/token':
+            with self.server.lock:
+                self.server.tokens += 1
+                number = self.server.tokens
+            self.send(200, {
+                'access_token': f'stub-access-{number}',
+                'refresh_token': f'stub-refresh-{number}',
+                'expires_in': TOKEN_SECONDS,
+                'token_type': 'Bearer',
+                'scope': ['read_station'],
+            })
+        elif netatmo and not self.headers.get('Authorization', '').startswith('Bearer '):
+            self.send(403, {'error': {'code': 2, 'message': 'Invalid access token'}})
+        elif path == '/api/getstationsdata':
+            self.send(200, {'body': stations_body(self.server.stations, now), 'status': 'ok', 'time_server': now})
+        elif path == '/api/getmeasure':
+            params = {name: values[0] for name, values in query.items()}
+            self.send(200, {'body': measure_body(self.server.stations, params, now), 'status': 'ok', 'time_server': now})
+        elif path.startswith('/data/') and path.endswith('/static/meta.json'):
+            self.send(200, model_meta(now))
+        elif path == '/v1/forecast':
+            # One timezone for all locations, or one each
+            sites = list(zip(_values(query, 'latitude'), _values(query, 'longitude')))
+            timezones = _values(query, 'timezone') or ['GMT']
+            if len(timezones) == 1:
+                timezones = timezones * len(sites)
+            messages = [forecast_message(float(latitude), float(longitude), _values(query, 'hourly'),
+                                         _values(query, 'daily'), timezone, now)
+                        for (latitude, longitude), timezone in zip(sites, timezones)]
+            self.send(200, b''.join(messages), 'application/octet-stream')
+        else:
+            self.send(404, {'error': {'code': 404, 'message': f'No stub for {path}'}})
+
+def start(port=0, **options):
+    # Runs the server in a background thread and returns it; port 0 picks a free port
+    server = StubServer(('127.0.0.1', port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--latency', type=float, default=0, help='Seconds to wait before each response')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of requests that fail with a 500')
+    parser.add_argument('--rate-limit', type=int, default=0, help='Requests allowed per minute before rate limiting')
+    parser.add_argument('--seed', type=int, help='Seed for the injected errors')
+    parser.add_argument('--verbose', action='store_true', help='Log each request')
+    args = parser.parse_args()
+
+    server = StubServer(('127.0.0.1', args.port), latency=args.latency, error_rate=args.error_rate,
+                        rate_limit=args.rate_limit, seed=args.seed, verbose=args.verbose)
+    print(f'Serving on {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+# Renders the display as it looked at each stored Netatmo measurement in a
+# time range and encodes the frames into a video:
+#
+#     python timelapse.py --start 2026-10-01 --end 2026-10-08 --output week.mp4
+#
+# The observations are rebuilt from the measurements in the store, with the
+# day's minimum and maximum, the trends and the rain totals worked out from
+# them; battery levels are the current ones. Forecasts are the latest stored
+# for each hour rather than what was forecast at the time.
+#
+# Frames are rendered in a pool of processes and passed to the encoder in
+# order, with only a few waiting at a time, so memory use does not grow with
+# the length of the video. MP4s are encoded by ffmpeg as the frames arrive;
+# GIFs are put together by Pillow at the end, so MP4 suits long ranges.
+
+import argparse
+import copy
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import toml
+
+import display
+import get_netatmo
+import startup
+import stations
+import store
+
+FPS = 24
+FRAMES_PER_WORKER = 4
+
+# Trends compare with the reading this long before
+TREND_SECONDS = 3 * 3600
+TREND_THRESHOLDS = {'temperature': 0.2, 'pressure': 0.5}
+
+INTEGER_TYPES = {'humidity', 'co2', 'noise', 'windstrength', 'windangle', 'guststrength', 'gustangle'}
+
+def snapshot_times(db, module_id, start, end, every=None):
+    times = store.measure_times(db, module_id, start, end)
+    if not every:
+        return times
+
+    # The first measurement in each interval
+    picked = []
+    for time in times:
+        if not picked or time >= picked[-1] // every * every + every:
+            picked.append(time)
+    return picked
+
+def load_history(db, model, start, end):
+    # (module ID, type) -> (times, values) arrays, from a day before start.
+    # getmeasure returns null for readings a module missed, which are dropped.
+    history = {}
+    for module_id, module in model['modules'].items():
+        for type in get_netatmo.MEASURE_TYPES.get(module['type'], []):
+            rows = store.load_measures(db, module_id, type, start - 86400, end)
+            values = np.array(rows, dtype=float).reshape(-1, 2)
+            values = values[~np.isnan(values[:, 1])]
+            history[(module_id, type)] = (values[:, 0], values[:, 1])
+    return history
+
+def _reading(value, type):
+    return int(value) if type in INTEGER_TYPES else round(float(value), 1)
+
+def _trend(times, values, index, type):
+    before = np.searchsorted(times, times[index] - TREND_SECONDS, 'right') - 1
+    if before < 0:
+        return 'stable'
+
+    change = values[index] - values[before]
+    threshold = TREND_THRESHOLDS[type]
+    return 'up' if change > threshold else 'down' if change < -threshold else 'stable'
+
+def snapshot(model, history, time, tz):
+    # The station model with each module's readings as they were at time
+    midnight = int(datetime.fromtimestamp(time, tz).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+
+    # Readings without a stored measurement keep their current value
+    model = copy.deepcopy(model)
+    for module_id, module in model['modules'].items():
+        data = dict(module['data'])
+        for type in get_netatmo.MEASURE_TYPES.get(module['type'], []):
+            times, values = history[(module_id, type)]
+            index = np.searchsorted(times, time, 'right') - 1
+            if index < 0:
+                continue
+
+            data[stations.DASHBOARD_KEYS[type]] = _reading(values[index], type)
+            data['time_utc'] = int(times[index])
+            first_today = np.searchsorted(times, midnight)
+
+            if type == 'temperature':
+                # Just after midnight the latest reading may still be yesterday's
+                today = values[min(first_today, index):index + 1]
+                data['min_temp'] = _reading(today.min(), type)
+                data['max_temp'] = _reading(today.max(), type)
+                data['temp_trend'] = _trend(times, values, index, type)
+            elif type == 'pressure':
+                data['pressure_trend'] = _trend(times, values, index, type)
+            elif type == 'rain':
+                data['sum_rain_1'] = float(values[np.searchsorted(times, time - 3600, 'right'):index + 1].sum())
+                data['sum_rain_24'] = float(values[first_today:index + 1].sum())
+
+        module['data'] = data
+        module['time'] = data.get('time_utc')
+
+    return model
+
+def frames(db, model, history, times, config, skipped):
+    # The inputs for each frame, read in the main process. Times the stored
+    # forecast does not cover, e.g. from before the retention period, are skipped.
+    location = display.location_name(config)
+    tz = display.local_timezone(config)
+    for time in times:
+        now = datetime.fromtimestamp(time, tz)
+        hourly, daily = display.load_forecast(db, now, location)
+        if len(hourly['date']) == 0 or hourly['date'][0] > time or len(daily['date']) < 2:
+            skipped.append(time)
+            continue
+
+        yield (snapshot(model, history, time, tz), hourly, daily, display.load_almanac(db, config, now), now)
+
+_config = None
+
+def init_worker(config):
+    global _config
+    _config = config
+
+def render_frame(inputs):
+    netatmo, hourly, daily, sun_days, now = inputs
+    # Consecutive frames rarely share panels, and the panel cache is for the live display
+    image = display.render_image(netatmo, hourly, daily, sun_days, _config, now=now, cache_dir=None)
+    return image.tobytes()
+
+def encode(output, frames, size, config, workers, fps):
+    import imageio.v2 as imageio
+
+    if output.lower().endswith('.gif'):
+        writer = imageio.get_writer(output, mode='I', duration=1000 / fps, loop=0)
+    else:
+        writer = imageio.get_writer(output, fps=fps)
+
+    count = 0
+    with writer, ProcessPoolExecutor(workers, initializer=init_worker, initargs=(config,)) as pool:
+        pending = deque()
+        for inputs in frames:
+            pending.append(pool.submit(render_frame, inputs))
+            if len(pending) >= workers * FRAMES_PER_WORKER:
+                writer.append_data(np.frombuffer(pending.popleft().result(), np.uint8).reshape(size[1], size[0], 3))
+                count += 1
+                if count % 100 == 0:
+                    print(f'  {count} frames')
+
+        while pending:
+            writer.append_data(np.frombuffer(pending.popleft().result(), np.uint8).reshape(size[1], size[0], 3))
+            count += 1
+
+    return count
+
+def parse_time(value, tz):
+    return int(tz.localize(datetime.fromisoformat(value)).timestamp())
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--start', required=True, help='Local date or time to start from, e.g. 2026-10-01 or 2026-10-01T06:00')
+    parser.add_argument('--end', help='Local date or time to end at (default: now)')
+    parser.add_argument('--output', default='timelapse.mp4', help='MP4 or GIF file to write')
+    parser.add_argument('--every', type=int, metavar='MINUTES', help='At most one frame per this many minutes')
+    parser.add_argument('--fps', type=int, default=FPS)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Rendering processes')
+    args = parser.parse_args()
+
+    with open('config.toml') as cin:
+        config = toml.loads(cin.read())
+    config['display'].pop('debug_png', None)
+
+    model = stations.load()
+    if model is None:
+        print('No Netatmo station data; run get_netatmo.py first')
+        return
+
+    tz = display.local_timezone(config)
+    start = parse_time(args.start, tz)
+    end = parse_time(args.end, tz) if args.end else int(datetime.now().timestamp())
+
+    # A frame for each of the main module's measurements, which has the station's ID
+    db = store.connect()
+    station_id = config['display'].get('station') or next(iter(model['stations']))
+    times = snapshot_times(db, station_id, start, end, args.every * 60 if args.every else None)
+    print(f'Rendering {len(times)} frames')
+
+    history = load_history(db, model, start, end)
+    skipped = []
+    count = encode(args.output, frames(db, model, history, times, config, skipped), (display.WIDTH, display.HEIGHT),
+                   config, args.workers, args.fps)
+    db.close()
+
+    if skipped:
+        print(f'Skipped {len(skipped)} frames with no stored forecast')
+    print(f'Wrote {count} frames to {args.output}')
+
+if __name__ == '__main__':
+    startup.profile_startup()
+    main()
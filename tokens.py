@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+import time
+import traceback
+
+import metrics
+
+# Netatmo access tokens last three hours, and each refresh returns a new
+# refresh token that replaces the old one. The latest token is kept in
+# TOKEN_FILE, written atomically so a crash mid-write cannot lose it. The
+# refresh token in the config is only used when there is no saved token yet.
+#
+# The daemon starts a background thread that renews the token well before it
+# expires, so fetches find a valid access token and never wait on a refresh.
+
+TOKEN_FILE = 'netatmo_token.json'
+
+# [netatmo] api_url replaces the base URL, e.g. to use stub_server.py
+NETATMO_URL = 'https://api.netatmo.com'
+TOKEN_PATH = '/oauth2/token'
+
+EXPIRY_MARGIN = 60
+RENEW_MARGIN = 900
+RETRY_SECONDS = 60
+
+def api_url(config, path):
+    return config['netatmo'].get('api_url', NETATMO_URL) + path
+
+def load_token(path=TOKEN_FILE):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return None
+
+def save_token(token, path=TOKEN_FILE):
+    tmp_file = f'{path}.tmp'
+    with open(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+        json.dump(token, f)
+    os.replace(tmp_file, path)
+
+class TokenManager:
+    def __init__(self, config, path=TOKEN_FILE):
+        self.config = config['netatmo']
+        self.url = api_url(config, TOKEN_PATH)
+        if self.url.startswith('http://'):
+            # oauthlib only allows plain HTTP when asked to, e.g. for stub_server.py
+            os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+        self.path = path
+        self.token = load_token(path)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _refresh(self, refresh_token):
+        from requests_oauthlib import OAuth2Session
+
+        with metrics.span('token_refresh'):
+            oauth = OAuth2Session(self.config['client_id'])
+            token = oauth.refresh_token(
+                self.url,
+                client_id=self.config['client_id'],
+                client_secret=self.config['client_secret'],
+                refresh_token=refresh_token
+            )
+
+        self.token = {
+            'access_token': token['access_token'],
+            'refresh_token': token['refresh_token'],
+            'expires_at': time.time() + token['expires_in']
+        }
+        save_token(self.token, self.path)
+
+    def _update(self):
+        if self.token is None:
+            self._refresh(self.config['init_refresh_token'])
+            return
+
+        try:
+            self._refresh(self.token['refresh_token'])
+        except Exception:
+            # A new refresh token in the config replaces a saved one that
+            # has been revoked
+            if self.config['init_refresh_token'] in ('', self.token['refresh_token']):
+                raise
+            self._refresh(self.config['init_refresh_token'])
+
+    def expires_at(self):
+        return self.token['expires_at'] if self.token else 0
+
+    def refresh(self, margin=EXPIRY_MARGIN):
+        # Checked under the lock, so a token renewed by another thread is
+        # used rather than refreshed again
+        with self.lock:
+            if time.time() >= self.expires_at() - margin:
+                self._update()
+
+    def access_token(self):
+        if time.time() >= self.expires_at() - EXPIRY_MARGIN:
+            self.refresh()
+        return self.token['access_token']
+
+    def headers(self):
+        return {
+            'Authorization': f'Bearer {self.access_token()}'
+        }
+
+    def start(self):
+        self.thread = threading.Thread(target=self._renew, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _renew(self):
+        while not self.stopped.wait(max(0, self.expires_at() - RENEW_MARGIN - time.time())):
+            try:
+                self.refresh(RENEW_MARGIN)
+            except Exception:
+                print('Netatmo token renewal failed')
+                traceback.print_exc()
+                if self.stopped.wait(RETRY_SECONDS):
+                    return